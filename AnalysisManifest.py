@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+
+
+# Fingerprint of every setting that changes a song's results
+# A song analyzed with a different fingerprint is treated as changed
+def params_fingerprint(*params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+# Remembers what was analyzed in earlier runs so only new or changed files are redone
+# entries: {path: {"size", "mtime", "sha256", "fingerprint", "song_name"}}
+class AnalysisManifest:
+    def __init__(self, path="PhraseBoundaries_Manifest.json"):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    # Splits file_paths into (to_analyze, skipped) and finds the deleted entries
+    # Size + mtime matching is enough to skip. If only the mtime moved, the content
+    # hash decides, so touching or copying a file back does not re-analyze it
+    def plan(self, file_paths, fingerprint, content_hash):
+        to_analyze, skipped = [], []
+        for path in file_paths:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+
+            if entry is None or entry["fingerprint"] != fingerprint:
+                to_analyze.append(path)
+            elif entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                skipped.append(path)
+            elif content_hash(path) == entry["sha256"]:
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+                skipped.append(path)
+            else:
+                to_analyze.append(path)
+
+        current = set(file_paths)
+        deleted = [path for path in self.entries if path not in current]
+        return to_analyze, skipped, deleted
+
+    def record(self, path, song_name, sha256, fingerprint):
+        stat = os.stat(path)
+        self.entries[path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256,
+            "fingerprint": fingerprint,
+            "song_name": song_name,
+        }
+
+    def remove(self, path):
+        return self.entries.pop(path, None)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,85 @@
+import glob
+import os
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+# Formats read directly through soundfile (libsndfile), no ffmpeg step needed
+AUDIO_EXTENSIONS = (".flac", ".wav")
+
+
+# Every audio file in the folders, one per song
+# A song that is in several folders (a FLAC and the WAV made from it) is only
+# returned once, from the first folder it is in
+def find_audio_files(folders):
+    if isinstance(folders, (str, Path)):
+        folders = [folders]
+
+    files = {}
+    for folder in folders:
+        for path in sorted(glob.glob(os.path.join(folder, "*"))):
+            stem, extension = os.path.splitext(os.path.basename(path))
+            if extension.lower() in AUDIO_EXTENSIONS:
+                files.setdefault(stem, path)
+    return sorted(files.values())
+
+
+# Decodes a file (or the part from offset to offset + duration seconds) as mono
+# and resamples it to sr with soxr, same result as librosa.load(res_type="soxr_hq")
+# The start is found by seeking to the frame, nothing before it is decoded
+# sr=None keeps the file's own sample rate
+def read_audio(path, sr=None, offset=0.0, duration=None, dtype="float32"):
+    with sf.SoundFile(path) as f:
+        native_sr = f.samplerate
+        start = min(f.frames, int(round(offset * native_sr)))
+        frames = -1 if duration is None else int(round(duration * native_sr))
+        if start:
+            f.seek(start)
+        y = f.read(frames=frames, dtype="float32", always_2d=True)
+
+    y = y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+    if sr is not None and sr != native_sr:
+        y = soxr.resample(y, native_sr, sr, quality="HQ")
+    else:
+        sr = native_sr
+    return np.ascontiguousarray(y, dtype=dtype), sr
+
+
+# Copies one file to a WAV in out_dir, block by block so it never holds the whole song
+# Returns the WAV path, files that were already converted are skipped
+def export_wav(path, out_dir, subtype="PCM_24", block_size=1 << 18):
+    out = os.path.join(out_dir, Path(path).stem + ".wav")
+    if os.path.exists(out):
+        return out
+
+    info = sf.info(path)
+    # written next to the output then renamed, so a stopped export never leaves half a WAV
+    tmp = f"{out}.{os.getpid()}.tmp"
+    with sf.SoundFile(
+        tmp, "w", samplerate=info.samplerate, channels=info.channels, subtype=subtype, format="WAV"
+    ) as f:
+        for block in sf.blocks(path, blocksize=block_size, dtype="float32", always_2d=True):
+            f.write(block)
+    os.replace(tmp, out)
+    return out
+
+
+# Parallel version of flac2wav.sh, one file per worker process
+def export_wavs(paths, out_dir, workers=None, subtype="PCM_24"):
+    os.makedirs(out_dir, exist_ok=True)
+    todo = [path for path in paths if not path.lower().endswith(".wav")]
+    if not todo:
+        return []
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    export = partial(export_wav, out_dir=out_dir, subtype=subtype)
+    outputs = []
+    with Pool(workers) as pool:
+        for i, out in enumerate(pool.imap_unordered(export, todo), 1):
+            print(f"[{i}/{len(todo)}] exported {out}")
+            outputs.append(out)
+    return outputs
@@ -0,0 +1,207 @@
+import os
+import queue
+import time
+
+from multiprocessing import Pool
+
+import psutil
+from threadpoolctl import threadpool_limits
+
+# Peak RSS of one worker (ru_maxrss of a fresh process running the whole full path
+# analysis, 44.1 kHz stereo input, 1-12 min, float32): about 280 MB of libraries
+# plus 2.3 MB per second of audio (STFT, HPSS masks, mel), plus the decoded file at
+# its own rate before resampling (4 bytes per sample)
+# The per second part is rounded up to 2.6 MB, so the estimate stays a few percent
+# above what was measured. float64 measured 4.9 MB per second, about double
+WORKER_BASE_BYTES = 280 * 1024**2
+BYTES_PER_AUDIO_SEC = 2.6 * 1024**2
+DECODE_BYTES_PER_SAMPLE = 4
+
+# Streaming mode only holds one block (60 s) of audio and features, so it is flat
+# apart from the per-frame novelty, chroma and onset arrays
+STREAMING_WORKER_BYTES = 550 * 1024**2
+STREAMING_BYTES_PER_AUDIO_SEC = 0.05 * 1024**2
+
+NATIVE_THREAD_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+
+# Peak memory of one job from the song descriptor, which only needs the header
+# (duration, and frames/channels when known), nothing is decoded
+def estimate_peak_memory(song, bytes_per_audio_sec=BYTES_PER_AUDIO_SEC):
+    duration = song.get("duration", 0.0)
+    if song.get("streaming"):
+        return STREAMING_WORKER_BYTES + STREAMING_BYTES_PER_AUDIO_SEC * duration
+
+    decoded = DECODE_BYTES_PER_SAMPLE * song.get("frames", 0) * song.get("channels", 1)
+    return WORKER_BASE_BYTES + bytes_per_audio_sec * duration + decoded
+
+
+# Runs in every worker before its first job
+# Each worker already gets its own core, so BLAS/OpenMP/numba pools inside it are capped
+# (otherwise 10 workers x N BLAS threads fight over the same cores)
+def limit_native_threads(n_threads):
+    for var in NATIVE_THREAD_VARS:
+        os.environ[var] = str(n_threads)
+    threadpool_limits(n_threads)
+    try:
+        import numba
+
+        numba.set_num_threads(min(n_threads, numba.config.NUMBA_NUM_THREADS))
+    except ImportError:
+        pass
+
+
+# Runs func over song descriptors ({"path", "duration", ...}) in a process pool
+# - jobs are only started while the estimated peak memory of everything running
+#   stays under the memory budget, a job that does not fit waits for memory to free
+#   up while shorter jobs behind it go first
+# - a song too big for the budget on its own is switched to streaming mode
+#   (song["streaming"] = True, bounded memory) when allow_streaming is set,
+#   and if it still does not fit it is deferred to the end and run alone
+# - otherwise jobs are started longest first so a long track does not end up running alone at the end
+# - worker count comes from the cores and how many of the smallest jobs fit in the budget
+# - workers are replaced after max_tasks_per_child songs to give back fragmented memory
+class BatchScheduler:
+    def __init__(
+        self,
+        workers=None,
+        memory_budget=None,
+        threads_per_worker=1,
+        max_tasks_per_child=20,
+        allow_streaming=True,
+        bytes_per_audio_sec=BYTES_PER_AUDIO_SEC,
+    ):
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.threads_per_worker = threads_per_worker
+        self.max_tasks_per_child = max_tasks_per_child
+        self.allow_streaming = allow_streaming
+        self.bytes_per_audio_sec = bytes_per_audio_sec
+
+    def budget(self):
+        if self.memory_budget is not None:
+            return self.memory_budget
+        return 0.8 * psutil.virtual_memory().available
+
+    def estimate(self, song):
+        return estimate_peak_memory(song, self.bytes_per_audio_sec)
+
+    def worker_count(self, songs, budget=None):
+        if self.workers is not None:
+            return max(1, min(self.workers, len(songs)))
+
+        cores = os.cpu_count() or 1
+        by_cores = max(1, cores // self.threads_per_worker)
+
+        if budget is None:
+            budget = self.budget()
+        smallest = min(self.estimate(song) for song in songs)
+        by_memory = max(1, int(budget // smallest))
+
+        return max(1, min(by_cores, by_memory, len(songs)))
+
+    # Orders the jobs and switches or defers the ones bigger than the whole budget
+    def plan(self, songs, budget):
+        songs = sorted(songs, key=lambda song: song.get("duration", 0.0), reverse=True)
+        fitting, deferred = [], []
+        for song in songs:
+            if self.estimate(song) > budget and self.allow_streaming and not song.get("streaming"):
+                song = dict(song, streaming=True)
+                print(f"  {song['path']} is too big for the memory budget, analyzing it in streaming mode")
+            if self.estimate(song) > budget:
+                print(f"  {song['path']} is too big for the memory budget even alone, deferred to the end")
+                deferred.append(song)
+            else:
+                fitting.append(song)
+        return fitting + deferred
+
+    def run(self, func, songs):
+        if not songs:
+            return
+
+        budget = self.budget()
+        pending = self.plan(songs, budget)
+        workers = self.worker_count(pending, budget)
+        total_audio = sum(song.get("duration", 0.0) for song in pending)
+        print(
+            f"Analyzing {len(pending)} songs ({format_duration(total_audio)} of audio) "
+            f"with {workers} workers x {self.threads_per_worker} threads, "
+            f"memory budget {budget / 1024**3:.1f} GB"
+        )
+
+        start = time.perf_counter()
+        done_audio = 0.0
+        finished = queue.Queue()
+        running = {}
+
+        with Pool(
+            workers,
+            initializer=limit_native_threads,
+            initargs=(self.threads_per_worker,),
+            maxtasksperchild=self.max_tasks_per_child,
+        ) as pool:
+
+            def admit():
+                while pending and len(running) < workers:
+                    in_use = sum(running.values())
+                    index = next(
+                        (
+                            i
+                            for i, song in enumerate(pending)
+                            if in_use + self.estimate(song) <= budget
+                        ),
+                        None,
+                    )
+                    if index is None:
+                        if running:
+                            return
+                        # nothing running and nothing fits, only deferred songs are left
+                        index = 0
+                    song = pending.pop(index)
+                    running[song["path"]] = self.estimate(song)
+                    pool.apply_async(
+                        func,
+                        (song,),
+                        callback=lambda result, song=song: finished.put((song, result, None)),
+                        error_callback=lambda e, song=song: finished.put((song, None, e)),
+                    )
+
+            for done in range(1, len(songs) + 1):
+                admit()
+                song, result, error = finished.get()
+                del running[song["path"]]
+                if error is not None:
+                    raise error
+
+                done_audio += song.get("duration", 0.0)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"[{done}/{len(songs)}] {result['song_name']} "
+                    f"elapsed {format_duration(elapsed)} "
+                    f"ETA {format_duration(eta(elapsed, done_audio, total_audio))}",
+                    flush=True,
+                )
+                yield result
+
+
+# Remaining time from the amount of audio left, song counts are misleading when
+# the longest songs go first
+def eta(elapsed, done_audio, total_audio):
+    if done_audio <= 0:
+        return float("nan")
+    return elapsed * (total_audio - done_audio) / done_audio
+
+
+def format_duration(seconds):
+    if seconds != seconds:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
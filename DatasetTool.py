@@ -1,102 +1,519 @@
-import glob
+import argparse
 import os
 import librosa
 import numpy as np
 import re
+import time
 import json
+import soundfile as sf
+import soxr
+import subprocess
+import sys
+import tempfile
 
-from locale import normalize
+from functools import cached_property, partial
 from pathlib import Path
-from scipy.signal import butter, filtfilt, find_peaks
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.signal import butter, filtfilt, find_peaks, sosfilt
 from scipy.stats import pearsonr
-from multiprocessing import Pool, Lock, Manager
 from multiprocessing.dummy import Pool as ThreadPool
-from WriteToJson import writeToJson
-
-
+from WriteToJson import ResultSink, merge_results
+from Sharding import read_paths_file, select_shard, shard_path
+from AudioFiles import export_wavs, find_audio_files, read_audio
+from FeatureCache import FeatureCache, file_content_hash
+from AnalysisManifest import AnalysisManifest, params_fingerprint
+from BatchScheduler import BYTES_PER_AUDIO_SEC, BatchScheduler
+from StageProfiler import StageProfiler, build_run_report
+
+
+# Songs are handed around as {"path", "sr", "duration", "frames", "channels"} descriptors
+# from the file header (the scheduler estimates memory from them)
+# Nothing is decoded here, preprocessing decodes each file once inside the worker
+# at the analysis sample rate (sr), so the parent process never holds any audio
 class SongLoader:
     def __init__(self):
         self.songs = []
 
-    def load_songs(self, file_path, sr=None):
+    def load_songs(self, file_path, sr=22050):
+        self.songs.extend(self.stream_songs(file_path, sr=sr))
 
-        if isinstance(file_path, str):
-            filePath = Path(file_path)
+    def stream_songs(self, file_path, sr=22050):
+        if isinstance(file_path, (str, Path)):
+            file_path = [file_path]
 
         # Taking each file in filepath
-        if isinstance(file_path, (list, tuple)):
-            for file in file_path:
-                try:
-                    # loads the raw waveform in y and stores the sample rate in sr
-                    y, sr = librosa.load(file, sr=sr)
-                    self.songs.append({"path": file, "y": y, "sr": sr})
-                except Exception as e:
-                    print(f" could not load {file}: {e}")
-        else:
+        for file in file_path:
             try:
-                y, sr = librosa.load(filePath, sr=sr)
-                self.songs.append({"path": filePath, "y": y, "sr": sr})
+                # only reads the header to make sure the file can be decoded later
+                info = sf.info(file)
             except Exception as e:
-                print(f" could not load {file_path}: {e}")
+                print(f" could not load {file}: {e}")
+                continue
+            yield {
+                "path": file,
+                "sr": sr,
+                "duration": info.duration,
+                "frames": info.frames,
+                "channels": info.channels,
+            }
 
     def get_songs(self):
         return self.songs
 
 
-def get_phrase_boundaries_complex(song, lock):
-    y_harm, y_perc, sr = preprocessing(song)
-
-    # Harmonic Features
-    chroma = compute_chroma(y_harm, sr)
-    mfcc = compute_mfcc(y_harm, sr)
-
-    # Percussion Features
-    tempogram, onset_env = compute_tempogram(y_perc, sr)
-    flux = compute_spectral_flux(y_perc, sr)
-    flux = np.pad(flux, (0, chroma.shape[1] - flux.shape[0]), mode="constant")
-
-    features = np.concatenate(
-        [chroma, mfcc, tempogram, onset_env[np.newaxis, :], flux[np.newaxis, :]], axis=0
-    )
-    features = librosa.util.normalize(features)
-
-    # Part comes from Chatgpt because
-    # I couldn't fully understand how to
-    # recreate Foote's design https://ccrma.stanford.edu/workshops/mir2009/references/Foote_00.pdf
-    SSM = cosine_similarity(features.T)
-    # novelty = compute_novelty(SSM, sr)
-    novelty = compute_novelty_gaussian(SSM, sr)
-    phrase_boundaries = post_process_novelty(novelty, sr)
-
-    path = Path(song["path"]).as_posix()
-
-    results_path = "PhraseBoundaries_Results.json"
+# Everything that changes the features or the novelty curve
+# Part of the feature cache key, so changing any of these recomputes the song
+ANALYSIS_PARAMS = {
+    # bump when an extractor changes so old cache entries are not reused
+    "feature_version": 2,
+    "sr": 22050,
+    "hop_length": 512,
+    "n_mfcc": 13,
+    "highpass_cutoff": 100.0,
+    # waveform, spectrograms, features, SSM and novelty, float64 is for validation
+    "dtype": "float32",
+}
+
+# How many boundaries from each end of a song go into the results
+EXPORTED_BOUNDARIES = 5
+
+# Half width of the novelty kernel in seconds
+NOVELTY_KERNEL_SEC = 0.5
+
+# Half width of the novelty kernel in beats when the features are beat synced (--sync beats)
+BEAT_KERNEL_BEATS = 8
+
+
+def get_phrase_boundaries_complex(
+    song,
+    sink,
+    cache=None,
+    peak_params=None,
+    profile=False,
+    sync="frames",
+    dtype=ANALYSIS_PARAMS["dtype"],
+    threads=1,
+):
+    profiler = StageProfiler(enabled=profile)
+    pool = ThreadPool(threads) if threads > 1 else None
+    try:
+        return analyze_song(
+            song, sink, cache, peak_params, profile, sync, dtype, profiler, pool
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def analyze_song(song, sink, cache, peak_params, profile, sync, dtype, profiler, pool):
+    params = dict(ANALYSIS_PARAMS, sr=song.get("sr", ANALYSIS_PARAMS["sr"]), dtype=dtype)
+    # streaming results differ slightly, so they get their own cache entries
+    streaming = song.get("streaming", False)
+    if streaming:
+        params["streaming"] = True
+    # so do the coarse features, streaming songs stay on the streaming path
+    coarse_to_fine = song.get("coarse_to_fine", False) and not streaming
+    if coarse_to_fine:
+        params["coarse_to_fine"] = True
+    sr = params["sr"]
+    hop_length = params["hop_length"]
+    L = int(NOVELTY_KERNEL_SEC * sr / hop_length)
+
+    # hashed once here, used for the cache key and returned for the manifest
+    with profiler.stage("hash"):
+        content_hash = file_content_hash(song["path"])
+
+    analysis = None
+    if cache is not None:
+        key = cache.key(song["path"], params, content_hash=content_hash)
+        with profiler.stage("cache_load"):
+            analysis = cache.load(key)
+
+    # The novelty curve is cached next to the features under its kernel size,
+    # so a different kernel only redoes the SSM/novelty and not the features
+    # Streaming entries have no feature matrix, a new kernel redoes the whole song
+    # Beat synced curves are cached with the start time of every beat
+    # Coarse-to-fine caches the coarse curve, the refinement depends on the peak params
+    if coarse_to_fine:
+        kernel, novelty_name, times_name = L, f"novelty_coarse_L{L}", None
+    elif sync == "frames" or streaming:
+        kernel, novelty_name, times_name = L, f"novelty_L{L}", None
+    else:
+        kernel = BEAT_KERNEL_BEATS
+        novelty_name, times_name = f"novelty_beats_L{kernel}", "beat_times"
+    if streaming and (analysis is None or novelty_name not in analysis):
+        analysis = extract_novelty_streaming(song, params, L, profiler=profiler)
+        if cache is not None:
+            with profiler.stage("cache_save"):
+                cache.save(key, **analysis)
+    elif coarse_to_fine and (analysis is None or novelty_name not in analysis):
+        analysis = extract_novelty_coarse(song, params, L, profiler=profiler, pool=pool)
+        if cache is not None:
+            with profiler.stage("cache_save"):
+                cache.save(key, **analysis)
+    elif analysis is None:
+        analysis = extract_features(song, params, profiler=profiler, pool=pool)
+
+    if novelty_name not in analysis:
+        features = analysis["features"]
+        if times_name is not None:
+            with profiler.stage("beat_sync"):
+                features, analysis[times_name] = beat_sync_features(
+                    features,
+                    analysis["onset_env"],
+                    sr,
+                    hop_length,
+                    bpm=float(analysis["tempo"]),
+                )
+            profiler.shape("beat_sync", features)
+        analysis[novelty_name] = compute_novelty_curve(
+            features, sr, kernel, profiler=profiler
+        )
+        if cache is not None:
+            with profiler.stage("cache_save"):
+                cache.save(key, **analysis)
+
+    with profiler.stage("peak_picking"):
+        if times_name is None:
+            phrase_boundaries = post_process_novelty(
+                analysis[novelty_name], sr, hop_length=hop_length, **(peak_params or {})
+            )
+        else:
+            # averaging over each beat already smooths the curve
+            phrase_boundaries = post_process_novelty(
+                analysis[novelty_name],
+                sr,
+                hop_length=hop_length,
+                smoothing_window=1,
+                times=analysis[times_name],
+                **(peak_params or {}),
+            )
+
+    # only the boundaries that are written out get the full resolution pass
+    if coarse_to_fine:
+        with profiler.stage("refine"):
+            phrase_boundaries = refine_boundaries(
+                song,
+                params,
+                L,
+                phrase_boundaries,
+                exported_indices(len(phrase_boundaries)),
+                pool=pool,
+            )
+
+    # from the tempogram and chroma the boundaries already used, no second pass
+    with profiler.stage("bpm_key"):
+        bpm = float(analysis["tempo"])
+        key, scale, key_strength = estimate_key(analysis["chroma"])
+
+    song_name = song_name_for(song["path"])
 
     data_dump = {
         "songs": [
             {
-                "song_name": re.sub(r"^Music/wav_files/", "", path),
+                "song_name": song_name,
                 "features": {
-                    "bpm": "",
-                    "key": "",
-                    "scale": "",
-                    "key_strength": "",
-                    "first_phrase_boundaries": format_boundaries(phrase_boundaries[:5]),
+                    "bpm": round(bpm, 2),
+                    "key": key,
+                    "scale": scale,
+                    "key_strength": round(key_strength, 4),
+                    "first_phrase_boundaries": format_boundaries(
+                        phrase_boundaries[:EXPORTED_BOUNDARIES]
+                    ),
                     "last_phrase_boundaries": format_boundaries(
-                        phrase_boundaries[len(phrase_boundaries) - 5 :]
+                        phrase_boundaries[len(phrase_boundaries) - EXPORTED_BOUNDARIES :]
                     ),
                 },
             }
         ]
     }
 
-    file_json = writeToJson(data_dump, results_path)
-    with lock:
-        if not os.path.exists(results_path):
-            file_json.create_file()
+    with profiler.stage("write"):
+        sink.append(data_dump["songs"])
+
+    result = {"path": song["path"], "song_name": song_name, "sha256": content_hash}
+    if profile:
+        result["profile"] = dict(
+            profiler.report(), path=song["path"], song_name=song_name
+        )
+    return result
+
+
+# Name a song is stored under in the results file
+def song_name_for(path):
+    return re.sub(r"^Music/(wav|flac)_files/", "", Path(path).as_posix())
+
+
+# Runs the feature extractors for one song and stacks them into one matrix (features x frames)
+# The chroma and onset envelope are returned too since they are useful on their own
+def extract_features(song, params=ANALYSIS_PARAMS, profiler=None, pool=None):
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    spec = preprocessing(
+        song,
+        hop_length=params["hop_length"],
+        cutoff=params["highpass_cutoff"],
+        profiler=profiler,
+        dtype=params["dtype"],
+        pool=pool,
+    )
+    analysis = spectral_features(spec, params, profiler=profiler, pool=pool)
+    # cheap from the tempogram, and lets --sync beats skip the beat tracker's own estimate
+    with profiler.stage("tempo"):
+        analysis["tempo"] = estimate_tempo(
+            analysis.pop("tempogram").mean(axis=1), spec.sr, params["hop_length"]
+        )
+    return analysis
+
+
+# The feature matrix of audio that is already in a SpectralContext
+# Also used on the short windows --coarse-to-fine refines its boundaries in
+# With a pool the harmonic and percussive branches run side by side (--song-threads),
+# their stage times then overlap in the profile
+def spectral_features(spec, params=ANALYSIS_PARAMS, profiler=None, pool=None):
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    with profiler.stage("hpss"):
+        spec.hpss
+    profiler.shape("hpss", spec.stft)
+
+    if pool is None:
+        chroma, mfcc = harmonic_features(spec, params, profiler)
+        tempogram, onset_env, flux = percussive_features(spec, params, profiler)
+    else:
+        # the two branches share nothing but the HPSS
+        harmonic = pool.apply_async(harmonic_features, (spec, params, profiler))
+        percussive = pool.apply_async(percussive_features, (spec, params, profiler))
+        chroma, mfcc = harmonic.get()
+        tempogram, onset_env, flux = percussive.get()
+
+    with profiler.stage("stack"):
+        features = stack_features(chroma, mfcc, tempogram, onset_env, flux)
+    profiler.shape("stack", features)
+
+    return {
+        "features": features,
+        "chroma": chroma,
+        "onset_env": onset_env,
+        "tempogram": tempogram,
+    }
+
+
+# Harmonic Features
+def harmonic_features(spec, params, profiler):
+    with profiler.stage("chroma"):
+        chroma = compute_chroma(sr=spec.sr, S=spec.harmonic_magnitude)
+    profiler.shape("chroma", chroma)
+    with profiler.stage("mfcc"):
+        mfcc = compute_mfcc(sr=spec.sr, S=spec.harmonic_mel_db, n_mfcc=params["n_mfcc"])
+    profiler.shape("mfcc", mfcc)
+    return chroma, mfcc
+
+
+# Percussion Features
+def percussive_features(spec, params, profiler):
+    with profiler.stage("tempogram"):
+        tempogram, onset_env = compute_tempogram(
+            sr=spec.sr, S=spec.percussive_mel_db, hop_length=params["hop_length"]
+        )
+    profiler.shape("tempogram", tempogram)
+    with profiler.stage("flux"):
+        flux = compute_spectral_flux(sr=spec.sr, S=spec.percussive_magnitude)
+    profiler.shape("flux", flux)
+    return tempogram, onset_env, flux
+
+
+# Coarse-to-fine mode (--coarse-to-fine)
+# Only the first and last EXPORTED_BOUNDARIES boundaries end up in the results, but
+# extract_features runs HPSS and the chroma nn_filter, most of its time, over the
+# whole song. Here the whole song only gets the same features from the unseparated
+# STFT (no HPSS, no nn_filter), which is enough to find and rank the boundaries.
+# The exported ones are then moved to the peak of the full feature novelty in a
+# window of +-COARSE_REFINE_SEC around them, decoded on its own with
+# COARSE_CONTEXT_SEC of extra audio on each side so the window edges do not matter.
+COARSE_REFINE_SEC = 1.0
+COARSE_CONTEXT_SEC = 2.0
+
+
+# The coarse novelty curve plus what bpm/key need, from one cheap pass over the song
+def extract_novelty_coarse(song, params, L, profiler=None, pool=None):
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    spec = preprocessing(
+        song,
+        hop_length=params["hop_length"],
+        cutoff=params["highpass_cutoff"],
+        profiler=profiler,
+        dtype=params["dtype"],
+        pool=pool,
+    )
+    sr = spec.sr
+
+    with profiler.stage("coarse_features"):
+        chroma = librosa.util.normalize(
+            librosa.feature.chroma_stft(S=spec.magnitude, sr=sr), axis=0
+        )
+        mfcc = compute_mfcc(sr=sr, S=spec.mel_db, n_mfcc=params["n_mfcc"])
+        tempogram, onset_env = compute_tempogram(
+            sr=sr, S=spec.mel_db, hop_length=params["hop_length"]
+        )
+        flux = compute_spectral_flux(sr=sr, S=spec.magnitude)
+        features = stack_features(chroma, mfcc, tempogram, onset_env, flux)
+    profiler.shape("coarse_features", features)
+    with profiler.stage("tempo"):
+        tempo = estimate_tempo(tempogram.mean(axis=1), sr, params["hop_length"])
+
+    return {
+        f"novelty_coarse_L{L}": compute_novelty_curve(features, sr, L, profiler=profiler),
+        "chroma": chroma,
+        "onset_env": onset_env,
+        "tempo": tempo,
+    }
+
+
+# Indices of the boundaries that go into first/last_phrase_boundaries
+def exported_indices(n):
+    indices = range(n)
+    return sorted(set(indices[:EXPORTED_BOUNDARIES]) | set(indices[n - EXPORTED_BOUNDARIES :]))
+
+
+# Moves each boundary in indices to the strongest point of the full resolution
+# novelty near it (same smoothing post_process_novelty uses), the others are kept
+# A boundary never moves past the midpoint to its neighbours, so two cannot meet.
+# Windows that overlap are decoded and analyzed together as one span, a short
+# song ends up as a single span instead of many windows over the same audio.
+# A boundary whose window has no novelty at all (too close to the song's edges) stays put
+def refine_boundaries(song, params, L, boundaries, indices, smoothing_window=25, pool=None):
+    sr = params["sr"]
+    hop_length = params["hop_length"]
+    coarse = np.asarray(boundaries, dtype=float)
+    refined = coarse.copy()
+    if len(indices) == 0:
+        return refined
+
+    # the part each boundary may move in
+    midpoints = (coarse[1:] + coarse[:-1]) / 2
+    lower = np.maximum(coarse - COARSE_REFINE_SEC, np.concatenate(([0.0], midpoints)))
+    upper = np.minimum(coarse + COARSE_REFINE_SEC, np.concatenate((midpoints, [np.inf])))
+
+    spans = []
+    for i in indices:
+        start = max(0.0, lower[i] - COARSE_CONTEXT_SEC)
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = upper[i] + COARSE_CONTEXT_SEC
+            spans[-1][2].append(i)
         else:
-            file_json.add_entry(data_dump)
+            spans.append([start, upper[i] + COARSE_CONTEXT_SEC, [i]])
+
+    for start, end, members in spans:
+        y, _ = read_audio(
+            song["path"], sr=sr, offset=start, duration=end - start, dtype=params["dtype"]
+        )
+        y = highpass_filter(y, sr, cutoff=params["highpass_cutoff"]).astype(y.dtype, copy=False)
+        spec = SpectralContext(y, sr, hop_length=hop_length, pool=pool)
+        analysis = spectral_features(spec, params, pool=pool)
+        novelty = compute_novelty_curve(analysis["features"], sr, L)
+        novelty = np.convolve(
+            novelty, np.ones(smoothing_window) / smoothing_window, mode="same"
+        )
+
+        for i in members:
+            lo = max(0, int(np.ceil((lower[i] - start) * sr / hop_length)))
+            hi = min(len(novelty), int(np.floor((upper[i] - start) * sr / hop_length)) + 1)
+            if hi > lo and novelty[lo:hi].max() > 0:
+                refined[i] = start + (lo + np.argmax(novelty[lo:hi])) * hop_length / sr
+
+    return refined
+
+
+# Tempo from the tempogram averaged over the song, weighted by the same log-normal
+# prior around 120 bpm librosa.feature.tempo uses
+# The peak is interpolated between lags, librosa returns the nearest lag only
+# (128 bpm comes out as 129.2 at hop 512)
+def estimate_tempo(tempogram_mean, sr, hop_length=512, start_bpm=120.0, max_tempo=320.0):
+    bpms = librosa.tempo_frequencies(len(tempogram_mean), sr=sr, hop_length=hop_length)
+    with np.errstate(divide="ignore"):
+        prior = np.exp(-0.5 * (np.log2(bpms) - np.log2(start_bpm)) ** 2)
+    prior[bpms > max_tempo] = 0
+    score = tempogram_mean * prior
+
+    lag = int(np.argmax(score))
+    if lag == 0:
+        return 0.0
+    if lag < len(score) - 1:
+        before, peak, after = score[lag - 1], score[lag], score[lag + 1]
+        curvature = before - 2 * peak + after
+        if curvature < 0:
+            return 60.0 * sr / (hop_length * (lag + 0.5 * (before - after) / curvature))
+    return float(bpms[lag])
+
+
+# Krumhansl-Kessler key profiles for C major and C minor
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+
+# Krumhansl-Schmuckler key finding: the song's average chroma is correlated with
+# both profiles shifted to all 12 tonics and the best match is the key
+# key_strength is that correlation, 1 would be a perfect match
+def estimate_key(chroma):
+    mean_chroma = np.mean(chroma, axis=1)
+    if np.ptp(mean_chroma) == 0:
+        return "", "", 0.0
+
+    best = ("", "", -1.0)
+    for scale, profile in (("major", MAJOR_PROFILE), ("minor", MINOR_PROFILE)):
+        for tonic in range(12):
+            strength = pearsonr(mean_chroma, np.roll(profile, tonic))[0]
+            if strength > best[2]:
+                best = (PITCH_CLASSES[tonic], scale, float(strength))
+    return best
+
+
+def stack_features(chroma, mfcc, tempogram, onset_env, flux):
+    flux = np.pad(flux, (0, chroma.shape[1] - flux.shape[0]), mode="constant")
+
+    features = np.concatenate(
+        [chroma, mfcc, tempogram, onset_env[np.newaxis, :], flux[np.newaxis, :]], axis=0
+    )
+    return librosa.util.normalize(features)
+
+
+# Averages the feature frames over each beat found in the onset envelope
+# Returns the synced features and the start time of every beat, the first
+# column covers the frames before the first beat
+# A known bpm skips the tempo estimation, which is most of the beat tracker's time
+def beat_sync_features(features, onset_env, sr, hop_length=512, bpm=None):
+    # trim=False keeps the beats in quiet intros, they still mark phrase starts
+    _, beats = librosa.beat.beat_track(
+        onset_envelope=onset_env, sr=sr, hop_length=hop_length, bpm=bpm, trim=False
+    )
+
+    # column i of the synced matrix covers frames bounds[i] to bounds[i + 1]
+    bounds = librosa.util.fix_frames(beats, x_min=0, x_max=features.shape[1])
+    synced = librosa.util.sync(features, bounds, aggregate=np.mean)
+    times = librosa.frames_to_time(bounds[:-1], sr=sr, hop_length=hop_length)
+    return synced, times
+
+
+# Part comes from Chatgpt because
+# I couldn't fully understand how to
+# recreate Foote's design https://ccrma.stanford.edu/workshops/mir2009/references/Foote_00.pdf
+# The novelty kernels only look 2L frames off the diagonal, so only that
+# band of the SSM is kept (O(N*L) instead of O(N^2))
+def compute_novelty_curve(features, sr, L, profiler=None):
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    with profiler.stage("ssm"):
+        SSM = BandedSSM(features, width=2 * L)
+    profiler.shape("ssm", SSM.band)
+    with profiler.stage("novelty"):
+        # return compute_novelty(SSM, sr, L=L)
+        return compute_novelty_gaussian(SSM, sr, L=L)
 
 
 # Converts to minute:second format
@@ -122,65 +539,153 @@ def post_process_novelty(
     min_peak_distance_sec=1.0,
     threshold_factor=1,
     top_k=10,
+    times=None,
+):
+    peak_params = {
+        "threshold_factor": threshold_factor,
+        "min_peak_distance_sec": min_peak_distance_sec,
+        "top_k": top_k,
+    }
+    return post_process_novelty_sweep(
+        novelty,
+        sr,
+        [peak_params],
+        hop_length=hop_length,
+        L=L,
+        smoothing_window=smoothing_window,
+        times=times,
+    )[0]
+
+
+# Defaults for the keys a parameter set given to post_process_novelty_sweep leaves out
+PEAK_PARAM_DEFAULTS = {"threshold_factor": 1, "min_peak_distance_sec": 1.0, "top_k": 10}
+
+
+# post_process_novelty for many parameter sets at once, returns one array of
+# boundary times per set. The smoothing is done once for all of them, and
+# find_peaks + the sustain check once per (threshold_factor, min_peak_distance_sec),
+# so sets that only change top_k cost next to nothing
+def post_process_novelty_sweep(
+    novelty,
+    sr,
+    param_sets,
+    hop_length=512,
+    L=None,
+    smoothing_window=25,
+    times=None,
 ):
     n_frames = len(novelty)
+    # Beat synced curves pass the time of every frame instead of a fixed hop
+    if times is None:
+        frame_rate = sr / hop_length
+    else:
+        frame_rate = 1.0 / np.median(np.diff(times)) if len(times) > 1 else 1.0
     if L is None:
-        L = int(2.0 * sr / hop_length)
+        L = int(2.0 * frame_rate)
 
     novelty_smooth = np.convolve(
         novelty, np.ones(smoothing_window) / smoothing_window, mode="same"
     )
-
-    min_height = np.mean(novelty_smooth) * threshold_factor
-    min_distance_frames = int(min_peak_distance_sec * sr / hop_length)
-
-    peaks, _ = find_peaks(
-        novelty_smooth, height=min_height, distance=min_distance_frames
-    )
-
-    # if len(peaks) == 0:
-    #     peaks = np.arange(L, n_frames, 2*L)
-
-    valid_peaks = []
-    min_sustain_frames = int(0.2 * sr / hop_length)
-
-    for peak in peaks:
-        start = max(0, peak - min_sustain_frames // 2)
-        end = min(n_frames, peak + min_sustain_frames // 2)
-        region = novelty_smooth[start:end]
-        if np.mean(region > min_height) > 0.6:
-            valid_peaks.append(peak)
-    if len(valid_peaks) == 0:
-        valid_peaks = np.arange(L, n_frames, 2 * L)
-
-    if len(valid_peaks) > top_k:
-        valid_peaks = np.array(valid_peaks)
-        top_indices = np.argsort(novelty_smooth[valid_peaks])[-top_k:][::-1]
-        valid_peaks = valid_peaks[top_indices]
-    valid_peaks = np.sort(valid_peaks)
-
-    return librosa.frames_to_time(valid_peaks, sr=sr, hop_length=hop_length)
-    # return librosa.frames_to_time(peaks, sr=sr, hop_length=hop_length)
+    mean_smooth = np.mean(novelty_smooth)
+
+    # the sustain region of a peak is [peak - half, peak + half) clipped to the curve
+    half = max(2, int(0.2 * frame_rate)) // 2
+
+    candidates = {}
+    boundaries = []
+    for params in param_sets:
+        params = dict(PEAK_PARAM_DEFAULTS, **params)
+        group = (params["threshold_factor"], params["min_peak_distance_sec"])
+        if group not in candidates:
+            min_height = mean_smooth * params["threshold_factor"]
+            min_distance_frames = max(1, int(params["min_peak_distance_sec"] * frame_rate))
+            peaks, _ = find_peaks(
+                novelty_smooth, height=min_height, distance=min_distance_frames
+            )
+
+            # Share of each sustain region above min_height, from a running count,
+            # a peak is kept when more than 60% of its region is above
+            above = np.concatenate([[0], np.cumsum(novelty_smooth > min_height)])
+            start = np.maximum(0, peaks - half)
+            end = np.minimum(n_frames, peaks + half)
+            valid_peaks = peaks[(above[end] - above[start]) / (end - start) > 0.6]
+
+            if len(valid_peaks) == 0:
+                valid_peaks = np.arange(L, n_frames, 2 * L)
+            candidates[group] = valid_peaks
+
+        valid_peaks = candidates[group]
+        top_k = params["top_k"]
+        if len(valid_peaks) > top_k:
+            top_indices = np.argsort(novelty_smooth[valid_peaks])[-top_k:][::-1]
+            valid_peaks = valid_peaks[top_indices]
+        valid_peaks = np.sort(valid_peaks)
+
+        if times is not None:
+            boundaries.append(np.asarray(times)[valid_peaks])
+        else:
+            boundaries.append(
+                librosa.frames_to_time(valid_peaks, sr=sr, hop_length=hop_length)
+            )
+    return boundaries
 
 
 def compute_novelty_gaussian(SSM, sr, L=None, hop_length=512, sigma=1.0):
     n_frames = SSM.shape[0]
-    novelty = np.zeros(n_frames)
+    novelty = np.zeros(n_frames, dtype=SSM.dtype)
 
     if L is None:
         L = int(0.5 * sr / hop_length)
     if 2 * L + 1 > n_frames:
         L = (n_frames - 1) // 2
 
-    kernel = gaussian_checkerboard(L, sigma=L / 2)
+    kernel = gaussian_checkerboard(L, sigma=L / 2).astype(SSM.dtype)
 
-    for t in range(L, n_frames - L):
-        block = SSM[t - L : t + L + 1, t - L : t + L + 1]
-        novelty[t] = np.sum(kernel * block)
+    # Same sum as sliding the (2L+1)^2 block down the diagonal, but done one
+    # lag at a time: SSM[r, r + lag] only ever meets kernel[i, i + lag], so each
+    # lag is a 1D correlation of that SSM diagonal with that kernel diagonal
+    for lag in range(-2 * L, 2 * L + 1):
+        novelty[L : n_frames - L] += np.correlate(
+            SSM.diagonal(offset=lag), kernel.diagonal(offset=lag), mode="valid"
+        )
 
     return novelty
 
 
+# Cosine self similarity matrix that only stores the diagonals up to |lag| <= width
+# The matrix is symmetric so the diagonal at -lag is the same as the one at +lag
+# band[lag, r] = SSM[r, r + lag]
+# diagonal() returns the same values np.diagonal would on the full matrix
+# The band has the dtype of the features
+class BandedSSM:
+    def __init__(self, features, width):
+        # Same as cosine_similarity(features.T), zero frames have similarity 0
+        norms = np.linalg.norm(features, axis=0)
+        norms[norms == 0] = 1.0
+        unit = features / norms
+
+        n_frames = features.shape[1]
+        self.shape = (n_frames, n_frames)
+        self.width = width
+        self.band = np.zeros((width + 1, n_frames), dtype=unit.dtype)
+        for lag in range(min(width, n_frames - 1) + 1):
+            self.band[lag, : n_frames - lag] = np.einsum(
+                "ij,ij->j", unit[:, : n_frames - lag], unit[:, lag:]
+            )
+
+    def diagonal(self, offset=0):
+        lag = abs(offset)
+        if lag > self.width:
+            raise ValueError(
+                f"Diagonal {offset} is outside the stored band (width {self.width})"
+            )
+        return self.band[lag, : max(0, self.shape[0] - lag)]
+
+    @property
+    def dtype(self):
+        return self.band.dtype
+
+
 # This creates the kernel used later for the SSM math
 def gaussian_checkerboard(L, sigma=1.0):
     x = np.arange(-L, L + 1)
@@ -202,36 +707,50 @@ def gaussian_checkerboard(L, sigma=1.0):
 
 def compute_novelty(SSM, sr, L=None, hop_length=512):
     n_frames = SSM.shape[0]
-    novelty = np.zeros(n_frames)
+    novelty = np.zeros(n_frames, dtype=SSM.dtype)
     if L is None:
         L = int(0.5 * sr / hop_length)
 
-    for t in range(L, n_frames - L):
-        left_block = SSM[t - L : t, t - L : t]
-        right_block = SSM[t : t + L, t : t + L]
-
-        novelty[t] = np.sum(np.abs(left_block - right_block))
+    if n_frames <= 2 * L:
+        return novelty
+
+    # |left_block - right_block| compares SSM[r, r + lag] with SSM[r + L, r + L + lag],
+    # so each lag is a running sum over the difference of one diagonal with itself shifted by L
+    for lag in range(-(L - 1), L):
+        diagonal = SSM.diagonal(offset=lag)
+        diff = np.abs(diagonal[:-L] - diagonal[L:])
+        novelty[L : n_frames - L] += np.correlate(
+            diff, np.ones(L - abs(lag)), mode="valid"
+        )[: n_frames - 2 * L]
     return novelty
 
 
 # This help detects beatdrops in the song
-def compute_spectral_flux(y, sr, hop_length=512, n_fft=2048):
-    spectogram = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
-    spec_norm = librosa.util.normalize(spectogram, axis=0)
+def compute_spectral_flux(
+    y=None, sr=22050, hop_length=512, n_fft=2048, S=None, normalize=True
+):
+    if S is None:
+        S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+    spec_norm = librosa.util.normalize(S, axis=0)
 
     flux = np.sqrt(np.sum(np.diff(spec_norm, axis=1) ** 2, axis=0))
-    flux = (flux - np.mean(flux)) / np.std(flux)
+    if normalize:
+        flux = (flux - np.mean(flux)) / np.std(flux)
     return flux
 
 
 # Detects the beat/tempo structure
 # The background beat that is played
 # Also detects onset which is when the musical note begins
-def compute_tempogram(y, sr):
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    tempogram = librosa.feature.tempogram(onset_envelope=onset_env, sr=sr)
-    tempogram = librosa.util.normalize(tempogram)
-    onset_env = librosa.util.normalize(onset_env)
+def compute_tempogram(y=None, sr=22050, S=None, hop_length=512, normalize=True):
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, S=S, hop_length=hop_length)
+    tempogram = librosa.feature.tempogram(
+        onset_envelope=onset_env, sr=sr, hop_length=hop_length
+    )
+    # librosa builds the tempogram in float64 whatever the input, keep the input's dtype
+    tempogram = librosa.util.normalize(tempogram).astype(onset_env.dtype, copy=False)
+    if normalize:
+        onset_env = librosa.util.normalize(onset_env)
     return tempogram, onset_env
 
 
@@ -240,18 +759,20 @@ def compute_tempogram(y, sr):
 # Helps detect sudden changes in instruments or vocals
 
 
-def compute_mfcc(y, sr):
-    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+def compute_mfcc(y=None, sr=22050, S=None, n_mfcc=13, normalize=True):
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, S=S, n_mfcc=n_mfcc)
     timbre = librosa.feature.delta(mfcc)
     mfcc_features = np.concatenate((mfcc, timbre))
-    mfcc_features = librosa.util.normalize(mfcc_features, axis=1)
+    if normalize:
+        mfcc_features = librosa.util.normalize(mfcc_features, axis=1)
     return mfcc_features
 
 
 # Extracts the Chroma which is the quality of pitch
 # Used to be categorized into one of twelve distinct pitch classes
-def compute_chroma(y, sr):
-    S = np.abs(librosa.stft(y))
+def compute_chroma(y=None, sr=22050, S=None):
+    if S is None:
+        S = np.abs(librosa.stft(y))
     chroma = librosa.feature.chroma_stft(S=S, sr=sr)
     chroma = librosa.decompose.nn_filter(chroma)
     chroma = librosa.util.normalize(chroma, axis=0)
@@ -260,15 +781,86 @@ def compute_chroma(y, sr):
 
 # This gets the audio waveform (y) and the sample rate (sr)
 # y is the audio data sr is the scale
+# Returns a SpectralContext so every feature shares the same STFT
+# y stays in dtype from here on, so the STFT and everything after it does too
 
 
-def preprocessing(song):
-    y, sr = librosa.load(song["path"])
-    y = librosa.util.normalize(y)
-    y = highpass_filter(y, sr)
-    y_harm, y_perc = librosa.effects.hpss(y)
-
-    return y_harm, y_perc, sr
+def preprocessing(
+    song, hop_length=512, cutoff=100.0, profiler=None, dtype="float32", pool=None
+):
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    with profiler.stage("load"):
+        # FLAC or WAV straight from soundfile, resampled with soxr
+        y, sr = read_audio(song["path"], sr=song.get("sr", 22050), dtype=dtype)
+        y = librosa.util.normalize(y)
+    profiler.shape("load", y)
+    with profiler.stage("highpass"):
+        # filtfilt always computes in float64
+        if pool is None:
+            y = highpass_filter(y, sr, cutoff=cutoff)
+        else:
+            y = highpass_filter_chunked(y, sr, pool, cutoff=cutoff)
+        y = y.astype(dtype, copy=False)
+
+    return SpectralContext(y, sr, hop_length=hop_length, pool=pool)
+
+
+# Every spectrogram the features need for one song, each computed once on first use
+# The harmonic/percussive split stays in the spectral domain, so there is no
+# iSTFT followed by another STFT of y_harm / y_perc like librosa.effects.hpss would need
+# All of them share n_fft/hop_length with the librosa defaults the features used before
+# Given a pool, the HPSS runs on time chunks in its threads
+class SpectralContext:
+    def __init__(self, y, sr, n_fft=2048, hop_length=512, pool=None):
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.pool = pool
+
+    @cached_property
+    def stft(self):
+        return librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length)
+
+    @cached_property
+    def hpss(self):
+        if self.pool is not None:
+            return hpss_chunked(self.stft, self.pool)
+        return librosa.decompose.hpss(self.stft, kernel_size=HPSS_KERNEL)
+
+    @cached_property
+    def harmonic_magnitude(self):
+        return np.abs(self.hpss[0])
+
+    @cached_property
+    def percussive_magnitude(self):
+        return np.abs(self.hpss[1])
+
+    # log-power mel spectrograms, what mfcc and onset_strength build from y internally
+    @cached_property
+    def harmonic_mel_db(self):
+        return self._mel_db(self.harmonic_magnitude)
+
+    @cached_property
+    def percussive_mel_db(self):
+        return self._mel_db(self.percussive_magnitude)
+
+    # the unseparated spectrogram, for the coarse pass of --coarse-to-fine
+    @cached_property
+    def magnitude(self):
+        return np.abs(self.stft)
+
+    @cached_property
+    def mel_db(self):
+        return self._mel_db(self.magnitude)
+
+    def _mel_db(self, magnitude):
+        mel = librosa.feature.melspectrogram(
+            S=magnitude**2, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length
+        )
+        return librosa.power_to_db(mel)
 
 
 # Gets rid of any unwanted noise
@@ -282,26 +874,580 @@ def highpass_filter(y, sr, cutoff=100.0):
     return y
 
 
+# Single song latency mode (--song-threads)
+# When one song is analyzed on demand the batch Pool has nothing to spread, so the
+# work inside the song goes to a ThreadPool instead: the highpass and the HPSS run
+# on time chunks, then the harmonic and percussive branches run side by side.
+# filtfilt, the median filters of the HPSS, the FFTs and the numpy math all release
+# the GIL, so the threads really do use separate cores.
+# The chunks overlap by more than the filters reach, so the joined result is the
+# same as running on the whole song (the highpass to float precision, the HPSS exactly)
+HIGHPASS_CHUNK_SEC = 30.0
+# the filter's response to a chunk edge is below 1e-15 after this at 100 Hz
+HIGHPASS_OVERLAP_SEC = 0.25
+HPSS_CHUNK_FRAMES = 2048
+# librosa's default, the harmonic median filter reaches HPSS_KERNEL // 2 frames each way
+HPSS_KERNEL = 31
+
+
+def highpass_filter_chunked(y, sr, pool, cutoff=100.0, chunk_sec=HIGHPASS_CHUNK_SEC):
+    chunk = int(chunk_sec * sr)
+    overlap = int(HIGHPASS_OVERLAP_SEC * sr)
+
+    def part(start):
+        lo = max(0, start - overlap)
+        hi = min(len(y), start + chunk + overlap)
+        return highpass_filter(y[lo:hi], sr, cutoff=cutoff)[start - lo : start - lo + chunk]
+
+    return np.concatenate(pool.map(part, range(0, len(y), chunk)))
+
+
+def hpss_chunked(stft, pool, chunk_frames=HPSS_CHUNK_FRAMES):
+    n_frames = stft.shape[1]
+    overlap = HPSS_KERNEL // 2
+
+    def part(start):
+        lo = max(0, start - overlap)
+        hi = min(n_frames, start + chunk_frames + overlap)
+        harmonic, percussive = librosa.decompose.hpss(stft[:, lo:hi], kernel_size=HPSS_KERNEL)
+        keep = slice(start - lo, start - lo + chunk_frames)
+        return harmonic[:, keep], percussive[:, keep]
+
+    parts = pool.map(part, range(0, n_frames, chunk_frames))
+    return (
+        np.concatenate([harmonic for harmonic, _ in parts], axis=1),
+        np.concatenate([percussive for _, percussive in parts], axis=1),
+    )
+
+
+# Streaming mode for hour long mixes
+# The audio is decoded, resampled and filtered block by block, and the features of
+# each block are computed with enough context on both sides (HPSS median filter,
+# tempogram window, deltas) that the kept frames match the full track computation.
+# The per-frame features go to a temporary .npy on disk, since the mfcc, onset and
+# flux rows need statistics over the whole track before they can be normalized.
+# Then the novelty is computed block by block from that file with L frames of overlap.
+# Memory stays bounded by the block size instead of the track length.
+# Differences from the full path:
+#  - the highpass runs the filter forward twice with carried state instead of filtfilt
+#    (same magnitude response, not zero phase)
+#  - the peak used to normalize the waveform is taken at the native sample rate
+#  - nn_filter on the chroma only finds neighbours inside the block + context
+
+STREAM_BLOCK_SEC = 60.0
+# 192 frames is half the tempogram window, the rest covers HPSS/delta/STFT
+STREAM_CONTEXT_FRAMES = 256
+
+
+def extract_novelty_streaming(song, params, L, profiler=None, block_sec=STREAM_BLOCK_SEC):
+    if profiler is None:
+        profiler = StageProfiler(enabled=False)
+
+    sr = params["sr"]
+    hop_length = params["hop_length"]
+    block_frames = max(2 * L + 1, int(block_sec * sr / hop_length))
+
+    info = sf.info(song["path"])
+    # a few frames of slack since the resampler's output length is only known at the end
+    capacity = 1 + int(np.ceil(info.frames * sr / info.samplerate)) // hop_length + 64
+    n_rows = 12 + 2 * params["n_mfcc"] + 384 + 2
+    dtype = params["dtype"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # frame major, so each block writes and reads contiguous rows
+        store = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "features.npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=(capacity, n_rows),
+        )
+
+        mfcc_rows = slice(12, 12 + 2 * params["n_mfcc"])
+        mfcc_max = np.zeros(2 * params["n_mfcc"])
+        onset_max = 0.0
+        tempogram_sum = 0.0
+        n_frames = 0
+
+        blocks = stream_audio_blocks(
+            song["path"],
+            sr,
+            hop_length,
+            params["highpass_cutoff"],
+            block_frames,
+            STREAM_CONTEXT_FRAMES,
+            profiler,
+        )
+        for chunk, chunk_frame, k0, k1 in blocks:
+            with profiler.stage("block_features"):
+                spec = SpectralContext(
+                    chunk.astype(dtype, copy=False), sr, hop_length=hop_length
+                )
+                keep = slice(k0 - chunk_frame, k1 - chunk_frame)
+
+                chroma = compute_chroma(sr=sr, S=spec.harmonic_magnitude)
+                mfcc = compute_mfcc(
+                    sr=sr,
+                    S=spec.harmonic_mel_db,
+                    n_mfcc=params["n_mfcc"],
+                    normalize=False,
+                )
+                tempogram, onset_env = compute_tempogram(
+                    sr=sr, S=spec.percussive_mel_db, hop_length=hop_length, normalize=False
+                )
+                flux = compute_spectral_flux(
+                    sr=sr, S=spec.percussive_magnitude, normalize=False
+                )
+                # flux[k] is the change from frame k to k + 1, the last frame has none
+                flux = np.pad(flux, (0, chroma.shape[1] - flux.shape[0]))
+
+                block = np.concatenate(
+                    [
+                        chroma[:, keep],
+                        mfcc[:, keep],
+                        tempogram[:, keep],
+                        onset_env[np.newaxis, keep],
+                        flux[np.newaxis, keep],
+                    ],
+                    axis=0,
+                )
+                if k1 > capacity:
+                    raise ValueError(f"{song['path']} decoded to more frames than expected")
+                store[k0:k1] = block.T
+
+                mfcc_max = np.maximum(mfcc_max, np.max(np.abs(mfcc[:, keep]), axis=1))
+                onset_max = max(onset_max, float(np.max(np.abs(onset_env[keep]))))
+                tempogram_sum = tempogram_sum + tempogram[:, keep].sum(axis=1, dtype=np.float64)
+                n_frames = k1
+
+        # global statistics for the rows the full path normalizes over the whole track
+        with profiler.stage("block_stats"):
+            flux_sum, flux_sq = 0.0, 0.0
+            for f0 in range(0, n_frames - 1, block_frames):
+                f1 = min(n_frames - 1, f0 + block_frames)
+                flux = store[f0:f1, -1].astype(np.float64)
+                flux_sum += flux.sum()
+                flux_sq += np.sum(flux**2)
+            flux_mean = flux_sum / max(1, n_frames - 1)
+            flux_std = np.sqrt(max(0.0, flux_sq / max(1, n_frames - 1) - flux_mean**2))
+
+        def normalized_block(a, b):
+            features = np.array(store[a:b].T, dtype=dtype)
+            features[mfcc_rows] /= np.where(mfcc_max > 0, mfcc_max, 1.0)[:, np.newaxis]
+            if onset_max > 0:
+                features[-2] /= onset_max
+            features[-1] = (features[-1] - flux_mean) / flux_std
+            if b == n_frames:
+                features[-1, -1] = 0.0
+            return librosa.util.normalize(features)
+
+        novelty = np.zeros(n_frames, dtype=dtype)
+        with profiler.stage("block_novelty"):
+            for f0 in range(0, n_frames, block_frames):
+                f1 = min(n_frames, f0 + block_frames)
+                # novelty[t] reads the features in [t - L, t + L]
+                a, b = max(0, f0 - L), min(n_frames, f1 + L)
+                lo, hi = max(f0, a + L), min(f1, b - L)
+                if lo >= hi:
+                    continue
+                SSM = BandedSSM(normalized_block(a, b), width=2 * L)
+                local = compute_novelty_gaussian(SSM, sr, L=L)
+                novelty[lo:hi] = local[lo - a : hi - a]
+
+        chroma = np.array(store[:n_frames, :12].T, dtype=dtype)
+        onset_env = np.array(store[:n_frames, -2], dtype=dtype)
+        if onset_max > 0:
+            onset_env /= onset_max
+        # closes the memmap before its temporary directory is removed
+        store = None
+
+    profiler.shape("block_novelty", novelty)
+    tempo = estimate_tempo(tempogram_sum / max(1, n_frames), sr, hop_length)
+    return {
+        f"novelty_L{L}": novelty,
+        "chroma": chroma,
+        "onset_env": onset_env,
+        "tempo": tempo,
+    }
+
+
+# Yields (chunk, chunk_frame, k0, k1): the filtered audio around frames [k0, k1),
+# where chunk starts at frame chunk_frame and has context_frames of audio on
+# each side of the block (less at the start and end of the track)
+def stream_audio_blocks(
+    path, sr, hop_length, cutoff, block_frames, context_frames, profiler
+):
+    context = context_frames * hop_length
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0
+    k0 = 0
+
+    def chunk_for(k0, k1, end):
+        chunk_start = max(0, k0 * hop_length - context)
+        chunk = buffer[chunk_start - buffer_start : end - buffer_start]
+        return chunk, chunk_start // hop_length, k0, k1
+
+    decoded = stream_decode(path, sr, cutoff, profiler)
+    for piece in decoded:
+        buffer = np.concatenate([buffer, piece])
+        while buffer_start + len(buffer) >= (k0 + block_frames) * hop_length + context:
+            k1 = k0 + block_frames
+            yield chunk_for(k0, k1, k1 * hop_length + context)
+            k0 = k1
+            drop = max(0, k0 * hop_length - context) - buffer_start
+            buffer = buffer[drop:]
+            buffer_start += drop
+
+    # what is left after the last full block, same frame count as librosa.stft(center=True)
+    total = buffer_start + len(buffer)
+    n_frames = 1 + total // hop_length
+    while k0 < n_frames:
+        k1 = min(n_frames, k0 + block_frames)
+        yield chunk_for(k0, k1, min(total, k1 * hop_length + context))
+        k0 = k1
+
+
+# Decodes the file block by block into normalized, resampled, highpassed mono audio
+# A first read pass only looks for the peak, so nothing is kept in memory
+def stream_decode(path, sr, cutoff, profiler, block_size=1 << 18):
+    with profiler.stage("decode"):
+        peak = 0.0
+        for block in sf.blocks(path, blocksize=block_size, dtype="float32", always_2d=True):
+            peak = max(peak, float(np.max(np.abs(block.mean(axis=1)), initial=0.0)))
+        scale = 1.0 / peak if peak > 0 else 1.0
+
+    native_sr = sf.info(path).samplerate
+    resampler = None
+    if native_sr != sr:
+        resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality="HQ")
+    highpass = StreamingHighpass(sr, cutoff=cutoff)
+
+    blocks = sf.blocks(path, blocksize=block_size, dtype="float32", always_2d=True)
+    last = False
+    while not last:
+        with profiler.stage("decode"):
+            block = next(blocks, None)
+            last = block is None
+            y = np.zeros(0, np.float32) if last else block.mean(axis=1)
+            if resampler is not None:
+                y = resampler.resample_chunk(y, last=last)
+            y = highpass(y * scale)
+        if len(y):
+            yield y.astype(np.float32)
+
+
+# Highpass with the filter state carried from one block to the next
+# Runs the butterworth forward twice, which has the same magnitude response as
+# filtfilt (forward + backward) but can be applied as the audio arrives
+class StreamingHighpass:
+    def __init__(self, sr, cutoff=100.0):
+        self.sos = butter(
+            N=2, Wn=cutoff / (sr / 2.0), btype="high", analog=False, output="sos"
+        )
+        self.state = [np.zeros((self.sos.shape[0], 2)) for _ in range(2)]
+
+    def __call__(self, y):
+        if len(y) == 0:
+            return y
+        for i in range(2):
+            y, self.state[i] = sosfilt(self.sos, y, zi=self.state[i])
+        return y
+
+
+# Runs count shards of the same command as separate processes on this machine and
+# merges their results, the same thing separate machines would do with --shard-index
+def run_local_shards(count, argv, results_path):
+    shards = []
+    for index in range(count):
+        command = [sys.executable, os.path.abspath(__file__), *argv]
+        command += ["--shard-index", str(index), "--shard-count", str(count)]
+        shards.append(subprocess.Popen(command))
+
+    failed = [index for index, shard in enumerate(shards) if shard.wait() != 0]
+    if failed:
+        print(f"Shards {failed} failed, not merging")
+        return False
+    return merge_shard_results(
+        [shard_path(results_path, index, count) for index in range(count)], results_path
+    )
+
+
+def merge_shard_results(paths, results_path):
+    try:
+        merged = merge_results(paths, results_path)
+    except FileNotFoundError as e:
+        print(f"Missing shard results: {e.filename}")
+        return False
+
+    for song_name, first, other in merged["conflicts"]:
+        print(f"Conflict: {song_name} differs between {first} and {other}")
+    if merged["conflicts"]:
+        print(f"{len(merged['conflicts'])} conflicts, {results_path} was not written")
+        return False
+    print(
+        f"Merged {len(paths)} files into {results_path}: {merged['songs']} songs, "
+        f"{merged['duplicates']} duplicates dropped"
+    )
+    return True
+
+
+# argv without an option and its value
+def without_option(argv, name):
+    kept, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == name:
+            skip = True
+        elif not arg.startswith(f"{name}="):
+            kept.append(arg)
+    return kept
+
+
 if __name__ == "__main__":
-    folder = "Music/wav_files/"
-    file_paths = glob.glob(os.path.join(folder, "*.wav"))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-dir", default=".feature_cache")
+    parser.add_argument("--cache-size-gb", type=float, default=10.0)
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always recompute the features"
+    )
+    # peak picking only, changing these reuses the cached novelty curves
+    parser.add_argument("--threshold-factor", type=float, default=1)
+    parser.add_argument("--min-peak-distance-sec", type=float, default=1.0)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only analyze new or changed files and drop results of deleted ones",
+    )
+    parser.add_argument("--manifest", default="PhraseBoundaries_Manifest.json")
+    parser.add_argument("--results", default="PhraseBoundaries_Results.json")
+    # sharding, every shard only analyzes its own slice and writes its own results
+    # (--results, --manifest and --profile with .shard-I-of-N added), --merge combines
+    # the results
+    parser.add_argument(
+        "--paths-file",
+        default=None,
+        help="text file with one audio path per line, instead of the music folders",
+    )
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument("--shard-count", type=int, default=1)
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        metavar="SHARD_JSON",
+        default=None,
+        help="merge these shard results into --results and exit",
+    )
+    parser.add_argument(
+        "--local-shards",
+        type=int,
+        default=None,
+        help="run this many shards as processes on this machine, then merge them",
+    )
+    # scheduler, the defaults are picked from the machine
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--memory-budget-gb", type=float, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument(
+        "--song-threads",
+        type=int,
+        default=1,
+        help="threads inside each song (chunked highpass/HPSS, feature branches side by side), "
+        "for low latency on one track use the number of cores",
+    )
+    parser.add_argument("--max-tasks-per-child", type=int, default=20)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="analyze every song in blocks (bounded memory, for long mixes)",
+    )
+    parser.add_argument(
+        "--streaming-min-minutes",
+        type=float,
+        default=30.0,
+        help="songs at least this long are always analyzed in blocks",
+    )
+    parser.add_argument(
+        "--sync",
+        choices=["frames", "beats"],
+        default="frames",
+        help="run the novelty and peak picking per frame or per beat "
+        "(songs analyzed with --streaming always use frames)",
+    )
+    parser.add_argument(
+        "--coarse-to-fine",
+        action="store_true",
+        help="find the boundaries with cheap features and only run the full features "
+        "around the exported ones, much faster (ignores --sync, not used for streaming songs)",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float64"],
+        default=ANALYSIS_PARAMS["dtype"],
+        help="precision of the whole pipeline, float64 to validate float32 results",
+    )
+    # FLACs are analyzed directly, a song in both folders is read from the first one
+    parser.add_argument(
+        "--music-dir",
+        action="append",
+        default=None,
+        help="folder with .flac/.wav files, can be given more than once "
+        "(default Music/flac_files and Music/wav_files)",
+    )
+    parser.add_argument(
+        "--export-wav",
+        action="store_true",
+        help="also write a WAV of every FLAC to Music/wav_files (what flac2wav.sh did)",
+    )
+    parser.add_argument("--export-workers", type=int, default=None)
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT_JSON",
+        default=None,
+        help="time every stage of every song and write a run report here",
+    )
+    args = parser.parse_args()
+
+    if args.merge:
+        sys.exit(0 if merge_shard_results(args.merge, args.results) else 1)
+
+    if args.local_shards:
+        argv = without_option(sys.argv[1:], "--local-shards")
+        # the shards share the machine, so each gets its part of the cores and
+        # of the memory, otherwise every shard would plan with 80% of the RAM
+        if args.workers is None:
+            argv += ["--workers", str(max(1, (os.cpu_count() or 1) // args.local_shards))]
+        if args.memory_budget_gb is None:
+            budget_gb = BatchScheduler().budget() / 1024**3 / args.local_shards
+            argv += ["--memory-budget-gb", f"{budget_gb:.3f}"]
+        sys.exit(0 if run_local_shards(args.local_shards, argv, args.results) else 1)
+
+    if args.paths_file:
+        file_paths = read_paths_file(args.paths_file)
+    else:
+        music_dirs = args.music_dir or ["Music/flac_files/", "Music/wav_files/"]
+        file_paths = find_audio_files(music_dirs)
+
+    results_path = args.results
+    manifest_path = args.manifest
+    profile_path = args.profile
+    if args.shard_count > 1:
+        file_paths = select_shard(file_paths, args.shard_index, args.shard_count)
+        results_path = shard_path(results_path, args.shard_index, args.shard_count)
+        manifest_path = shard_path(manifest_path, args.shard_index, args.shard_count)
+        if profile_path is not None:
+            profile_path = shard_path(profile_path, args.shard_index, args.shard_count)
+        print(
+            f"Shard {args.shard_index} of {args.shard_count}: {len(file_paths)} songs"
+        )
+
+    if args.export_wav:
+        export_wavs(file_paths, "Music/wav_files/", workers=args.export_workers)
+    cache = None
+    if not args.no_cache:
+        cache = FeatureCache(args.cache_dir, max_bytes=int(args.cache_size_gb * 1024**3))
+    peak_params = {
+        "threshold_factor": args.threshold_factor,
+        "min_peak_distance_sec": args.min_peak_distance_sec,
+        "top_k": args.top_k,
+    }
+
+    streaming_min_sec = 0.0 if args.streaming else args.streaming_min_minutes * 60
+    fingerprint = params_fingerprint(
+        dict(ANALYSIS_PARAMS, dtype=args.dtype),
+        NOVELTY_KERNEL_SEC,
+        peak_params,
+        streaming_min_sec,
+        args.sync,
+        args.coarse_to_fine,
+    )
+
+    # Results of songs re-analyzed or deleted since the last run are dropped from the output
+    drop_songs = []
+    manifest = None
+    if args.incremental:
+        manifest = AnalysisManifest(manifest_path)
+        # without the previous results there is nothing to skip against
+        if not os.path.exists(results_path):
+            manifest.entries = {}
+
+        file_paths, skipped, deleted = manifest.plan(
+            file_paths, fingerprint, file_content_hash
+        )
+        drop_songs.extend(song_name_for(path) for path in file_paths)
+        for path in deleted:
+            drop_songs.append(manifest.remove(path)["song_name"])
+
+        print(f"Skipping {len(skipped)} unchanged songs")
+        for path in skipped:
+            print(f"  skipped {path}")
+        print(f"Removing {len(deleted)} deleted songs")
+        for path in deleted:
+            print(f"  removed {path}")
+        print(f"Analyzing {len(file_paths)} new or changed songs")
+
+    # only the headers are read here, for the durations the scheduler sorts by
     loader = SongLoader()
-    loader.load_songs(file_paths)
-
-    songs = loader.get_songs()
-
-    # Simple threading for each song to speed up the process
-    max_threads = 10
-    if len(songs) < max_threads:
-        max_threads = len(songs)
-
-    with Manager() as manager:
-        lock = manager.Lock()
-        if songs:
-            # get_phrase_boundaries_complex(songs)
-            with Pool(max_threads) as pool:
-                pool.starmap(
-                    get_phrase_boundaries_complex, [(song, lock) for song in songs]
+    songs = list(loader.stream_songs(file_paths))
+    for song in songs:
+        song["streaming"] = song["duration"] >= streaming_min_sec
+        song["coarse_to_fine"] = args.coarse_to_fine
+
+    scheduler = BatchScheduler(
+        workers=args.workers,
+        memory_budget=(
+            int(args.memory_budget_gb * 1024**3) if args.memory_budget_gb else None
+        ),
+        # the song threads count as the worker's cores
+        threads_per_worker=max(args.threads_per_worker, args.song_threads),
+        max_tasks_per_child=args.max_tasks_per_child,
+        # float64 doubles every array the estimate scales with the song length
+        bytes_per_audio_sec=BYTES_PER_AUDIO_SEC * (2 if args.dtype == "float64" else 1),
+    )
+
+    # workers append to the journal on their own, it becomes the JSON file at the end
+    sink = ResultSink(results_path)
+
+    if songs:
+        # workers only receive the path, the song is decoded inside the worker
+        worker = partial(
+            get_phrase_boundaries_complex,
+            sink=sink,
+            cache=cache,
+            peak_params=peak_params,
+            profile=profile_path is not None,
+            sync=args.sync,
+            dtype=args.dtype,
+            threads=args.song_threads,
+        )
+        run_start = time.perf_counter()
+        song_reports = []
+        for result in scheduler.run(worker, songs):
+            if manifest is not None:
+                manifest.record(
+                    result["path"], result["song_name"], result["sha256"], fingerprint
                 )
-        else:
-            print("no songs")
+            if "profile" in result:
+                song_reports.append(result["profile"])
+
+        if profile_path is not None:
+            report = build_run_report(
+                song_reports, wall_time=time.perf_counter() - run_start
+            )
+            with open(profile_path, "w") as f:
+                json.dump(report, f, indent=4)
+            print(f"Run report written to {profile_path}")
+
+    # a shard always writes its file, even empty, so the merge finds every shard
+    # Without --incremental a shard file only holds this run's songs, so running
+    # the shards again (say after changing --top-k) and merging again is fine,
+    # the old entries would otherwise show up as conflicts with the new ones
+    if file_paths or drop_songs or args.shard_count > 1:
+        sink.finalize(
+            drop_songs=drop_songs, replace=args.shard_count > 1 and not args.incremental
+        )
+    elif manifest is None:
+        print("no songs")
+
+    if manifest is not None:
+        manifest.save()
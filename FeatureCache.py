@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import zipfile
+
+from pathlib import Path
+
+import numpy as np
+
+
+# sha256 of the file bytes, so a renamed or copied song still hits the cache
+# and an edited one with the same name does not
+def file_content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# On disk cache of the per-song arrays (features, onset envelope, novelty, ...)
+# Each entry is one uncompressed .npz named after the content hash + extraction params
+# Reading an entry bumps its mtime, and when the directory grows past max_bytes
+# the least recently used entries are removed first
+class FeatureCache:
+    def __init__(self, cache_dir=".feature_cache", max_bytes=10 * 1024**3):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, path, params, content_hash=None):
+        if content_hash is None:
+            content_hash = file_content_hash(path)
+        digest = hashlib.sha256(content_hash.encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return self.cache_dir / f"{key}.npz"
+
+    def load(self, key):
+        entry = self.entry_path(key)
+        try:
+            with np.load(entry) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Discarding unreadable cache entry {entry.name}: {e}")
+            entry.unlink(missing_ok=True)
+            return None
+        return arrays
+
+    def save(self, key, **arrays):
+        entry = self.entry_path(key)
+        # Written next to the entry then renamed, so other workers never see half a file
+        tmp = entry.with_name(f"{entry.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, **arrays)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in self.cache_dir.glob("*.npz"):
+            # another worker's entry still being written, it is not in the cache yet
+            if ".tmp." in entry.name:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
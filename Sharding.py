@@ -0,0 +1,31 @@
+import hashlib
+import os
+
+
+# Which of count shards a song belongs to
+# Taken from a hash of the song name, so every machine agrees on it whatever order
+# its list is in or where the music is mounted, and adding songs never moves others
+def shard_of(song_name, count):
+    digest = hashlib.sha256(song_name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+# The paths of shard index out of count, key gives the name a path is sharded by
+def select_shard(paths, index, count, key=os.path.basename):
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index {index} is not in 0..{count - 1}")
+    return [path for path in paths if shard_of(key(path), count) == index]
+
+
+# A list of audio paths, one per line, blank lines and # comments are ignored
+def read_paths_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+# Where shard index of count writes a file that is normally at path
+# PhraseBoundaries_Results.json -> PhraseBoundaries_Results.shard-2-of-8.json
+def shard_path(path, index, count):
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{count}{extension}"
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from contextlib import contextmanager
+
+import numpy as np
+import psutil
+
+
+# Records wall time, peak RSS and array shapes and dtypes for each named stage of one song
+# RSS is sampled from a background thread while the stage runs, so very short
+# spikes can be missed. A disabled profiler does nothing, so the hooks can stay in place
+class StageProfiler:
+    def __init__(self, enabled=True, interval=0.01):
+        self.enabled = enabled
+        self.interval = interval
+        self.stages = {}
+        self._process = psutil.Process() if enabled else None
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        peak = [self._process.memory_info().rss]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.interval):
+                peak[0] = max(peak[0], self._process.memory_info().rss)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+            peak[0] = max(peak[0], self._process.memory_info().rss)
+            record = self.stages.setdefault(name, {})
+            record["wall_s"] = record.get("wall_s", 0.0) + wall
+            record["peak_rss_mb"] = max(record.get("peak_rss_mb", 0.0), peak[0] / 1024**2)
+
+    # Shape and dtype of the array a stage produced (samples for audio, bins x frames for features)
+    def shape(self, name, array):
+        if self.enabled:
+            record = self.stages.setdefault(name, {})
+            record["shape"] = list(np.shape(array))
+            record["dtype"] = str(np.asarray(array).dtype)
+
+    def report(self):
+        return {
+            "stages": self.stages,
+            "total_wall_s": sum(stage.get("wall_s", 0.0) for stage in self.stages.values()),
+        }
+
+
+# Combines the per-song reports returned by the workers into one run report
+# with the per-song numbers and per-stage totals and percentiles
+def build_run_report(song_reports, wall_time=None):
+    stages = {}
+    for song in song_reports:
+        for name, stage in song["stages"].items():
+            if "wall_s" in stage:
+                stages.setdefault(name, []).append(stage)
+
+    stage_summary = {}
+    for name, records in stages.items():
+        walls = np.array([record["wall_s"] for record in records])
+        rss = np.array([record["peak_rss_mb"] for record in records])
+        stage_summary[name] = {
+            "songs": len(records),
+            "total_wall_s": float(walls.sum()),
+            "mean_wall_s": float(walls.mean()),
+            "p50_wall_s": float(np.percentile(walls, 50)),
+            "p90_wall_s": float(np.percentile(walls, 90)),
+            "p99_wall_s": float(np.percentile(walls, 99)),
+            "max_wall_s": float(walls.max()),
+            "p50_peak_rss_mb": float(np.percentile(rss, 50)),
+            "max_peak_rss_mb": float(rss.max()),
+        }
+
+    song_walls = [song["total_wall_s"] for song in song_reports]
+    return {
+        "run_wall_s": wall_time,
+        "songs_profiled": len(song_reports),
+        "total_song_wall_s": float(sum(song_walls)),
+        "p50_song_wall_s": float(np.percentile(song_walls, 50)) if song_walls else 0.0,
+        "p90_song_wall_s": float(np.percentile(song_walls, 90)) if song_walls else 0.0,
+        "stages": dict(
+            sorted(stage_summary.items(), key=lambda item: -item[1]["total_wall_s"])
+        ),
+        "songs": song_reports,
+    }
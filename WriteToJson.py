@@ -67,3 +67,130 @@ class writeToJson:
 
         with open(self.path, "w") as f:
             json.dump(self.data, f, indent=4, ensure_ascii=False)
+
+
+# Append-only version of add_entry for many workers writing to the same results
+# Entries go to a journal next to the results file (one JSON object per line),
+# each append is a single O_APPEND write so workers never wait on each other
+# and nothing already written is rewritten. finalize() folds the journal into
+# the usual {"songs": [...]} file once the run is done.
+class ResultSink:
+    def __init__(self, path, journal_path=None):
+        self.path = path
+        self.journal_path = journal_path or f"{path}.journal"
+        # records before this offset were left by an earlier run that never finalized
+        try:
+            self.run_start = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            self.run_start = 0
+
+    def append(self, songs):
+        # every record starts on a fresh line, so a write torn by a crash
+        # can only lose itself and never the record appended after it
+        payload = "".join("\n" + json.dumps(song) for song in songs) + "\n"
+
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, payload.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # The records between byte offsets start and stop, the whole journal by default
+    def read_journal(self, start=0, stop=None):
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(start)
+                chunk = f.read() if stop is None else f.read(max(0, stop - start))
+        except FileNotFoundError:
+            return []
+
+        songs = []
+        for line in chunk.decode("utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                songs.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping incomplete record in {self.journal_path}")
+        return songs
+
+    # drop_songs: song names whose previous entries should be removed first,
+    # used when a song was re-analyzed or its file is gone. This covers records
+    # a crashed run left in the journal too, the ones from this run are kept.
+    # A song in the journal more than once (analyzed by a crashed run and again by
+    # this one) is kept once, its last record
+    # replace: start from an empty file, the previous results and whatever an
+    # earlier run left in the journal are dropped
+    def finalize(self, drop_songs=(), replace=False):
+        data = {"songs": []}
+        if not replace:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+        if "songs" not in data:
+            data["songs"] = []
+        drop_songs = set(drop_songs)
+        data["songs"] = [
+            song for song in data["songs"] if song.get("song_name") not in drop_songs
+        ]
+
+        previous = []
+        if not replace:
+            previous = [
+                song
+                for song in self.read_journal(stop=self.run_start)
+                if song.get("song_name") not in drop_songs
+            ]
+        latest = {}
+        for song in previous + self.read_journal(start=self.run_start):
+            latest.pop(song.get("song_name"), None)
+            latest[song.get("song_name")] = song
+        data["songs"].extend(latest.values())
+
+        # the journal is only removed once the new results file is in place
+        write_json_atomic(self.path, data)
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+        return data
+
+
+# Replaces the file in one step so a crash leaves either the old file or the new one
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4, ensure_ascii="utf-8")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Combines the results files of several shards into one {"songs": [...]} file
+# A song found in more than one file is kept once if its entries are identical,
+# entries that differ are conflicts and nothing is written while there are any
+# Returns {"songs", "duplicates", "conflicts": [(song_name, first_file, other_file)]}
+def merge_results(paths, out_path):
+    songs, sources = {}, {}
+    duplicates, conflicts = 0, []
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        for song in data.get("songs", []):
+            name = song.get("song_name")
+            if name not in songs:
+                songs[name] = song
+                sources[name] = path
+            elif songs[name] == song:
+                duplicates += 1
+            else:
+                conflicts.append((name, sources[name], path))
+
+    if not conflicts:
+        write_json_atomic(out_path, {"songs": list(songs.values())})
+    return {"songs": len(songs), "duplicates": duplicates, "conflicts": conflicts}
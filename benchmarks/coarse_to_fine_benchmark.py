@@ -0,0 +1,92 @@
+# Compares the full pipeline with --coarse-to-fine on synthetic tracks
+# (see synthetic_audio.py), from decoding to the final boundaries.
+#
+# Both pick --top-k boundaries, coarse-to-fine refines the exported ones
+# (first and last EXPORTED_BOUNDARIES). Accuracy is measured on the exported
+# boundaries against the known section starts, at a loose and a tight tolerance.
+#
+# usage: python benchmarks/coarse_to_fine_benchmark.py [--minutes 4 5 6] [--top-k 10]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    ANALYSIS_PARAMS,
+    NOVELTY_KERNEL_SEC,
+    compute_novelty_curve,
+    exported_indices,
+    extract_features,
+    extract_novelty_coarse,
+    post_process_novelty,
+    refine_boundaries,
+)
+from sync_benchmark import boundary_scores  # noqa: E402
+from synthetic_audio import SR, synthetic_track  # noqa: E402
+
+TOLERANCES = [0.5, 0.1]
+
+
+def full(song, L, top_k):
+    analysis = extract_features(song, ANALYSIS_PARAMS)
+    novelty = compute_novelty_curve(analysis["features"], SR, L)
+    return post_process_novelty(novelty, SR, hop_length=ANALYSIS_PARAMS["hop_length"], top_k=top_k)
+
+
+def coarse_to_fine(song, L, top_k):
+    analysis = extract_novelty_coarse(song, ANALYSIS_PARAMS, L)
+    boundaries = post_process_novelty(
+        analysis[f"novelty_coarse_L{L}"], SR, hop_length=ANALYSIS_PARAMS["hop_length"], top_k=top_k
+    )
+    return refine_boundaries(
+        song, ANALYSIS_PARAMS, L, boundaries, exported_indices(len(boundaries))
+    )
+
+
+def run(minutes, seed, tmp_dir, top_k):
+    y, truth = synthetic_track(minutes, seed=seed)
+    path = os.path.join(tmp_dir, f"synthetic_{minutes:g}min.wav")
+    sf.write(path, y, SR)
+    del y
+    # the first section start is the start of the track, nothing to detect there
+    truth = truth[1:]
+    song = {"path": path, "sr": SR}
+    L = int(NOVELTY_KERNEL_SEC * SR / ANALYSIS_PARAMS["hop_length"])
+
+    print(f"\n{minutes:g} min, {len(truth)} section changes")
+    header = "".join(f" {f'precision@{t:g}s':>15}" for t in TOLERANCES)
+    print(f"  {'mode':<15} {'time (s)':>9} {'speedup':>8}{header}")
+    base = None
+    for name, func in (("full", full), ("coarse-to-fine", coarse_to_fine)):
+        start = time.perf_counter()
+        boundaries = func(song, L, top_k)
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        exported = boundaries[exported_indices(len(boundaries))]
+        scores = "".join(
+            f" {boundary_scores(exported, truth, t)[0]:>15.2f}" for t in TOLERANCES
+        )
+        print(f"  {name:<15} {elapsed:>9.2f} {base / elapsed:>7.1f}x{scores}")
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[4, 5, 6])
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for seed, minutes in enumerate(args.minutes, 1):
+            run(minutes, seed, tmp_dir, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Runs the phrase boundary pipeline in float32 (the default) and float64 on
+# synthetic tracks (see synthetic_audio.py) and compares the two:
+#  - wall time and peak RSS of every stage, each dtype in its own fresh process
+#    so the float64 run does not inherit the float32 run's memory
+#  - the novelty curves and the boundaries they produce
+#
+# With --check the exit status is 1 when any float32 boundary is further than
+# --tolerance seconds from its float64 counterpart.
+#
+# usage: python benchmarks/dtype_benchmark.py [--minutes 3 10] [--tolerance 0.05] [--check]
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    ANALYSIS_PARAMS,
+    NOVELTY_KERNEL_SEC,
+    compute_novelty_curve,
+    extract_features,
+    post_process_novelty,
+)
+from StageProfiler import StageProfiler  # noqa: E402
+from synthetic_audio import SR, synthetic_track  # noqa: E402
+
+DTYPES = ["float32", "float64"]
+STAGES = ["load", "highpass", "hpss", "chroma", "mfcc", "tempogram", "flux", "stack", "ssm", "novelty"]
+
+
+def run_pipeline(path, dtype):
+    params = dict(ANALYSIS_PARAMS, dtype=dtype)
+    sr = params["sr"]
+    hop_length = params["hop_length"]
+    L = int(NOVELTY_KERNEL_SEC * sr / hop_length)
+
+    profiler = StageProfiler(interval=0.005)
+    analysis = extract_features({"path": path, "sr": sr}, params, profiler=profiler)
+    novelty = compute_novelty_curve(analysis["features"], sr, L, profiler=profiler)
+    boundaries = post_process_novelty(novelty, sr, hop_length=hop_length, top_k=1000)
+
+    return {
+        "stages": profiler.stages,
+        "feature_mb": analysis["features"].nbytes / 1024**2,
+        "novelty": novelty,
+        "boundaries": boundaries,
+    }
+
+
+# Matches every float64 boundary with the closest float32 one
+def boundary_differences(boundaries, reference):
+    if len(boundaries) == 0 or len(reference) == 0:
+        return np.array([np.inf])
+    return np.min(np.abs(reference[:, np.newaxis] - boundaries[np.newaxis, :]), axis=1)
+
+
+def run(minutes, tmp_dir, tolerance):
+    y, _ = synthetic_track(minutes, seed=0)
+    path = os.path.join(tmp_dir, f"synthetic_{minutes:g}min.wav")
+    sf.write(path, y, SR)
+    del y
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for dtype in DTYPES:
+        with context.Pool(1) as pool:
+            results[dtype] = pool.apply(run_pipeline, (path, dtype))
+    os.remove(path)
+
+    single, double = results["float32"], results["float64"]
+    print(f"\n{minutes:g} min")
+    print(f"  {'stage':<10} {'f32 wall (s)':>12} {'f64 wall (s)':>12} {'f32 RSS (MB)':>13} {'f64 RSS (MB)':>13}")
+    for name in STAGES:
+        a, b = single["stages"].get(name), double["stages"].get(name)
+        if a is None or b is None:
+            continue
+        print(f"  {name:<10} {a['wall_s']:>12.3f} {b['wall_s']:>12.3f} "
+              f"{a['peak_rss_mb']:>13.1f} {b['peak_rss_mb']:>13.1f}")
+
+    wall = [sum(stage.get("wall_s", 0.0) for stage in r["stages"].values()) for r in (single, double)]
+    rss = [max(stage.get("peak_rss_mb", 0.0) for stage in r["stages"].values()) for r in (single, double)]
+    print(f"  {'total':<10} {wall[0]:>12.3f} {wall[1]:>12.3f} {rss[0]:>13.1f} {rss[1]:>13.1f}")
+    print(f"  feature matrix {single['feature_mb']:.1f} MB vs {double['feature_mb']:.1f} MB")
+
+    novelty_error = np.max(np.abs(single["novelty"] - double["novelty"])) / np.max(np.abs(double["novelty"]))
+    differences = boundary_differences(single["boundaries"], double["boundaries"])
+    print(f"  novelty max error {novelty_error:.2e} (relative to the peak)")
+    print(f"  boundaries {len(single['boundaries'])} vs {len(double['boundaries'])}, "
+          f"largest difference {np.max(differences):.3f} s")
+    return len(single["boundaries"]) == len(double["boundaries"]) and np.max(differences) <= tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3, 10])
+    parser.add_argument("--tolerance", type=float, default=0.05, help="seconds")
+    parser.add_argument("--check", action="store_true", help="fail if the boundaries differ")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        within = [run(minutes, tmp_dir, args.tolerance) for minutes in args.minutes]
+
+    if not all(within):
+        print(f"\nfloat32 boundaries differ from float64 by more than {args.tolerance} s")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
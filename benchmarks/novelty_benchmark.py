@@ -0,0 +1,141 @@
+# Compares the vectorized compute_novelty_gaussian / compute_novelty against the
+# original per-frame loops on synthetic feature matrices the size of 3, 10 and 60 minute tracks
+#
+# A dense SSM for an hour of audio does not fit in memory (N = 155k frames), so
+# both versions read from a BandedSSM, which holds every SSM value the kernels
+# can reach (|lag| <= 2L); the loop versions get block slicing on top of it.
+# For the shortest track the results are also checked against the real
+# cosine_similarity matrix.
+#
+# usage: python benchmarks/novelty_benchmark.py [--minutes 3 10 60]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    BandedSSM,
+    compute_novelty,
+    compute_novelty_gaussian,
+    gaussian_checkerboard,
+)
+
+SR = 22050
+HOP_LENGTH = 512
+# chroma (12) + mfcc/delta (26) + tempogram (384) + onset + flux
+N_FEATURES = 424
+
+
+# The original implementations, kept here as the reference
+def compute_novelty_gaussian_loop(SSM, sr, L=None, hop_length=512, sigma=1.0):
+    n_frames = SSM.shape[0]
+    novelty = np.zeros(n_frames)
+
+    if L is None:
+        L = int(0.5 * sr / hop_length)
+    if 2 * L + 1 > n_frames:
+        L = (n_frames - 1) // 2
+
+    kernel = gaussian_checkerboard(L, sigma=L / 2)
+
+    for t in range(L, n_frames - L):
+        block = SSM[t - L : t + L + 1, t - L : t + L + 1]
+        novelty[t] = np.sum(kernel * block)
+
+    return novelty
+
+
+def compute_novelty_loop(SSM, sr, L=None, hop_length=512):
+    n_frames = SSM.shape[0]
+    novelty = np.zeros(n_frames)
+    if L is None:
+        L = int(0.5 * sr / hop_length)
+
+    for t in range(L, n_frames - L):
+        left_block = SSM[t - L : t, t - L : t]
+        right_block = SSM[t : t + L, t : t + L]
+
+        novelty[t] = np.sum(np.abs(left_block - right_block))
+    return novelty
+
+
+# Adds the block slicing the loop versions need on top of the stored band
+class BlockBandedSSM(BandedSSM):
+    def __getitem__(self, index):
+        rows, cols = index
+        r = np.arange(*rows.indices(self.shape[0]))
+        c = np.arange(*cols.indices(self.shape[1]))
+        lags = c[np.newaxis, :] - r[:, np.newaxis]
+        first = np.minimum(r[:, np.newaxis], c[np.newaxis, :])
+        return self.band[np.abs(lags), first]
+
+
+# Section-structured features: a new random centroid every 8-24 seconds plus frame noise
+def synthetic_features(minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    n_frames = int(minutes * 60 * SR / HOP_LENGTH)
+    frames_per_sec = SR / HOP_LENGTH
+
+    features = np.empty((N_FEATURES, n_frames))
+    start = 0
+    while start < n_frames:
+        length = int(rng.uniform(8, 24) * frames_per_sec)
+        centroid = rng.normal(size=(N_FEATURES, 1))
+        end = min(n_frames, start + length)
+        features[:, start:end] = centroid + 0.5 * rng.normal(size=(N_FEATURES, end - start))
+        start = end
+    return features
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3, 10, 60])
+    args = parser.parse_args()
+
+    L = int(0.5 * SR / HOP_LENGTH)
+    print(f"L = {L}, kernel = {2 * L + 1}x{2 * L + 1}")
+    print(
+        f"{'novelty':>9} {'minutes':>8} {'frames':>8} {'loop (s)':>10} {'vector (s)':>11} "
+        f"{'speedup':>8} {'max abs diff':>13} {'band MB':>8} {'dense MB':>9}"
+    )
+
+    pairs = [
+        ("gaussian", compute_novelty_gaussian_loop, compute_novelty_gaussian),
+        ("abs diff", compute_novelty_loop, compute_novelty),
+    ]
+
+    for minutes in args.minutes:
+        features = synthetic_features(minutes)
+        SSM = BlockBandedSSM(features, width=2 * L)
+        n_frames = SSM.shape[0]
+
+        for name, loop, vectorized in pairs:
+            expected, loop_time = timed(loop, SSM, SR, L=L)
+            novelty, vector_time = timed(vectorized, SSM, SR, L=L)
+            diff = np.max(np.abs(novelty - expected))
+
+            print(
+                f"{name:>9} {minutes:>8g} {n_frames:>8d} {loop_time:>10.3f} {vector_time:>11.3f} "
+                f"{loop_time / vector_time:>7.1f}x {diff:>13.2e} "
+                f"{SSM.band.nbytes / 1e6:>8.1f} {n_frames**2 * 8 / 1e6:>9.0f}"
+            )
+
+            if minutes == min(args.minutes) and minutes <= 5:
+                dense = cosine_similarity(features.T)
+                dense_diff = np.max(np.abs(vectorized(SSM, SR, L=L) - loop(dense, SR, L=L)))
+                print(f"{'':>9} banded vs dense cosine_similarity SSM: max abs diff {dense_diff:.2e}")
+
+if __name__ == "__main__":
+    main()
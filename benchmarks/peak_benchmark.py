@@ -0,0 +1,129 @@
+# Compares post_process_novelty / post_process_novelty_sweep against the original
+# per-peak loop on novelty curves of synthetic feature matrices (see novelty_benchmark.py)
+#
+# Single: one call with the default peak parameters
+# Sweep: a grid of threshold_factor x min_peak_distance_sec x top_k, the loop
+# version is called once per parameter set, the sweep once for the whole grid
+# Every output is checked against the loop version.
+#
+# usage: python benchmarks/peak_benchmark.py [--minutes 3 10 60]
+
+import argparse
+import itertools
+import sys
+import time
+from pathlib import Path
+
+import librosa
+import numpy as np
+from scipy.signal import find_peaks
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    compute_novelty_curve,
+    post_process_novelty,
+    post_process_novelty_sweep,
+)
+from novelty_benchmark import HOP_LENGTH, SR, synthetic_features  # noqa: E402
+
+GRID = {
+    "threshold_factor": [0.5, 0.75, 1, 1.25, 1.5],
+    "min_peak_distance_sec": [0.5, 1.0, 2.0],
+    "top_k": [5, 10, 20, 1000],
+}
+
+
+# The original implementation, kept here as the reference
+def post_process_novelty_loop(
+    novelty,
+    sr,
+    hop_length=512,
+    L=None,
+    smoothing_window=25,
+    min_peak_distance_sec=1.0,
+    threshold_factor=1,
+    top_k=10,
+):
+    n_frames = len(novelty)
+    if L is None:
+        L = int(2.0 * sr / hop_length)
+
+    novelty_smooth = np.convolve(
+        novelty, np.ones(smoothing_window) / smoothing_window, mode="same"
+    )
+
+    min_height = np.mean(novelty_smooth) * threshold_factor
+    min_distance_frames = int(min_peak_distance_sec * sr / hop_length)
+
+    peaks, _ = find_peaks(
+        novelty_smooth, height=min_height, distance=min_distance_frames
+    )
+
+    valid_peaks = []
+    min_sustain_frames = int(0.2 * sr / hop_length)
+
+    for peak in peaks:
+        start = max(0, peak - min_sustain_frames // 2)
+        end = min(n_frames, peak + min_sustain_frames // 2)
+        region = novelty_smooth[start:end]
+        if np.mean(region > min_height) > 0.6:
+            valid_peaks.append(peak)
+    if len(valid_peaks) == 0:
+        valid_peaks = np.arange(L, n_frames, 2 * L)
+
+    if len(valid_peaks) > top_k:
+        valid_peaks = np.array(valid_peaks)
+        top_indices = np.argsort(novelty_smooth[valid_peaks])[-top_k:][::-1]
+        valid_peaks = valid_peaks[top_indices]
+    valid_peaks = np.sort(valid_peaks)
+
+    return librosa.frames_to_time(valid_peaks, sr=sr, hop_length=hop_length)
+
+
+def best_time(func, repeats=5):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3, 10, 60])
+    args = parser.parse_args()
+
+    L = int(0.5 * SR / HOP_LENGTH)
+    param_sets = [dict(zip(GRID, values)) for values in itertools.product(*GRID.values())]
+    print(f"sweep of {len(param_sets)} parameter sets")
+    print(
+        f"{'minutes':>8} {'peaks':>6} {'single loop (s)':>16} {'single (s)':>11} {'speedup':>8} "
+        f"{'sweep loop (s)':>15} {'sweep (s)':>10} {'speedup':>8} {'same':>5}"
+    )
+
+    for minutes in args.minutes:
+        novelty = compute_novelty_curve(synthetic_features(minutes).astype(np.float32), SR, L)
+        n_peaks = len(find_peaks(novelty)[0])
+
+        expected, single_loop = best_time(lambda: post_process_novelty_loop(novelty, SR))
+        result, single = best_time(lambda: post_process_novelty(novelty, SR))
+        same = np.array_equal(result, expected)
+
+        expected, sweep_loop = best_time(
+            lambda: [post_process_novelty_loop(novelty, SR, **params) for params in param_sets],
+            repeats=1,
+        )
+        results, sweep = best_time(lambda: post_process_novelty_sweep(novelty, SR, param_sets))
+        same = same and all(np.array_equal(a, b) for a, b in zip(results, expected))
+
+        print(
+            f"{minutes:>8g} {n_peaks:>6d} {single_loop:>16.4f} {single:>11.4f} "
+            f"{single_loop / single:>7.1f}x {sweep_loop:>15.3f} {sweep:>10.4f} "
+            f"{sweep_loop / sweep:>7.1f}x {str(same):>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# Times every stage of the phrase boundary pipeline on synthetic tracks
+# (see synthetic_audio.py) and records wall time and peak RSS per stage.
+#
+# Baselines are JSON files in benchmarks/baselines/. --save writes the current
+# run as the baseline, --compare prints each stage next to the baseline and
+# flags stages that got slower or bigger than --tolerance.
+#
+# usage: python benchmarks/pipeline_benchmark.py [--minutes 3 10 60] [--save | --compare]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from pathlib import Path
+
+import librosa
+import numpy as np
+import psutil
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    ANALYSIS_PARAMS,
+    NOVELTY_KERNEL_SEC,
+    compute_novelty_curve,
+    extract_features,
+    post_process_novelty,
+)
+from StageProfiler import StageProfiler  # noqa: E402
+from synthetic_audio import SR, synthetic_track  # noqa: E402
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+MIN_WALL_DELTA_S = 0.05
+MIN_RSS_DELTA_MB = 20.0
+STAGES = [
+    "load",
+    "highpass",
+    "hpss",
+    "chroma",
+    "mfcc",
+    "tempogram",
+    "tempo",
+    "flux",
+    "stack",
+    "ssm",
+    "novelty",
+    "peak_picking",
+]
+
+
+# Same stages a worker records with --profile
+def run_pipeline(path, profiler):
+    sr = ANALYSIS_PARAMS["sr"]
+    hop_length = ANALYSIS_PARAMS["hop_length"]
+    L = int(NOVELTY_KERNEL_SEC * sr / hop_length)
+
+    analysis = extract_features({"path": path, "sr": sr}, ANALYSIS_PARAMS, profiler=profiler)
+    novelty = compute_novelty_curve(analysis["features"], sr, L, profiler=profiler)
+    with profiler.stage("peak_picking"):
+        boundaries = post_process_novelty(novelty, sr, hop_length=hop_length)
+
+    return boundaries
+
+
+# Fraction of the detected boundaries within tolerance seconds of a real section change
+def boundary_precision(detected, truth, tolerance=1.0):
+    if len(detected) == 0:
+        return 0.0
+    distance = np.min(np.abs(np.asarray(detected)[:, np.newaxis] - truth[np.newaxis, :]), axis=1)
+    return float(np.mean(distance <= tolerance))
+
+
+def run(minutes_list, tmp_dir):
+    results = {}
+    for minutes in minutes_list:
+        y, truth = synthetic_track(minutes, seed=0)
+        path = os.path.join(tmp_dir, f"synthetic_{minutes:g}min.wav")
+        sf.write(path, y, SR)
+        del y
+
+        profiler = StageProfiler(interval=0.005)
+        boundaries = run_pipeline(path, profiler)
+        os.remove(path)
+
+        results[f"{minutes:g}"] = {
+            "stages": profiler.stages,
+            "total_wall_s": profiler.report()["total_wall_s"],
+            "boundary_precision": boundary_precision(boundaries, truth),
+        }
+        print_run(minutes, results[f"{minutes:g}"])
+    return results
+
+
+def print_run(minutes, result, baseline=None, tolerance=0.1):
+    print(f"\n{minutes:g} min  total {result['total_wall_s']:.2f} s  "
+          f"boundary precision {result['boundary_precision']:.2f}")
+    print(f"  {'stage':<13} {'wall (s)':>9} {'peak RSS (MB)':>14}", end="")
+    print(f" {'base wall':>10} {'change':>8} {'base RSS':>9} {'change':>8}" if baseline else "")
+
+    for name in STAGES:
+        stage = result["stages"].get(name)
+        if stage is None:
+            continue
+        line = f"  {name:<13} {stage['wall_s']:>9.3f} {stage['peak_rss_mb']:>14.1f}"
+        if baseline and name in baseline["stages"]:
+            base = baseline["stages"][name]
+            wall_change = relative_change(stage["wall_s"], base["wall_s"])
+            rss_change = relative_change(stage["peak_rss_mb"], base["peak_rss_mb"])
+            line += (
+                f" {base['wall_s']:>10.3f} {wall_change:>+7.0%} "
+                f"{base['peak_rss_mb']:>9.1f} {rss_change:>+7.0%}"
+            )
+            # tiny stages are noisy, so small absolute changes are not flagged
+            slower = wall_change > tolerance and stage["wall_s"] - base["wall_s"] > MIN_WALL_DELTA_S
+            bigger = rss_change > tolerance and stage["peak_rss_mb"] - base["peak_rss_mb"] > MIN_RSS_DELTA_MB
+            if slower or bigger:
+                line += "  REGRESSION"
+        print(line)
+
+
+def relative_change(current, base):
+    if base == 0:
+        return 0.0
+    return current / base - 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3, 10, 60])
+    parser.add_argument("--baseline", default="pipeline.json", help="file in benchmarks/baselines")
+    parser.add_argument("--save", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    baseline_path = BASELINE_DIR / args.baseline
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run(args.minutes, tmp_dir)
+
+    if args.compare:
+        with open(baseline_path, "r") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline_path} ({baseline['machine']})")
+        for minutes, result in results.items():
+            if minutes not in baseline["runs"]:
+                print(f"\n{minutes} min is not in the baseline")
+                continue
+            print_run(float(minutes), result, baseline["runs"][minutes], args.tolerance)
+
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(
+                {"machine": machine_description(), "runs": results}, f, indent=4
+            )
+        print(f"\nSaved baseline to {baseline_path}")
+
+
+def machine_description():
+    return (
+        f"{platform.machine()} {os.cpu_count()} cores, "
+        f"{psutil.virtual_memory().total / 1024**3:.0f} GB, "
+        f"python {platform.python_version()}, numpy {np.__version__}, librosa {librosa.__version__}"
+    )
+
+
+if __name__ == "__main__":
+    main()
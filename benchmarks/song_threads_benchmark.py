@@ -0,0 +1,69 @@
+# Single song latency with --song-threads: times extract_features on one synthetic
+# track (see synthetic_audio.py) single threaded and with a ThreadPool of each
+# size in --threads, and checks the features are the same.
+# The speedup is bounded by the cores of the machine and by the longer of the
+# two feature branches, which runs after the HPSS.
+#
+# usage: python benchmarks/song_threads_benchmark.py [--minutes 5] [--threads 2 4 8]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import ANALYSIS_PARAMS, extract_features  # noqa: E402
+from StageProfiler import StageProfiler  # noqa: E402
+from synthetic_audio import SR, synthetic_track  # noqa: E402
+
+STAGES = ["load", "highpass", "hpss", "chroma", "mfcc", "tempogram", "flux", "stack", "tempo"]
+
+
+def run(song, threads):
+    profiler = StageProfiler()
+    start = time.perf_counter()
+    if threads == 1:
+        analysis = extract_features(song, ANALYSIS_PARAMS, profiler=profiler)
+    else:
+        with ThreadPool(threads) as pool:
+            analysis = extract_features(song, ANALYSIS_PARAMS, profiler=profiler, pool=pool)
+    return analysis, time.perf_counter() - start, profiler.stages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--threads", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    y, _ = synthetic_track(args.minutes, seed=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"synthetic_{args.minutes:g}min.wav")
+        sf.write(path, y, SR)
+        del y
+        song = {"path": path, "sr": SR}
+
+        print(f"{args.minutes:g} min track, {os.cpu_count()} cores")
+        print(f"  {'threads':>7} {'wall (s)':>9} {'speedup':>8} {'same':>5}  stage walls (s)")
+        # the first run also warms up librosa's caches, it is not timed
+        reference, _, _ = run(song, 1)
+        base = None
+        for threads in [1] + args.threads:
+            analysis, wall, stages = run(song, threads)
+            base = base or wall
+            same = all(np.array_equal(analysis[k], reference[k]) for k in reference)
+            walls = " ".join(
+                f"{name}={stages[name]['wall_s']:.2f}" for name in STAGES if name in stages
+            )
+            print(f"  {threads:>7} {wall:>9.2f} {base / wall:>7.1f}x {str(same):>5}  {walls}")
+
+
+if __name__ == "__main__":
+    main()
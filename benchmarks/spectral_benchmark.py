@@ -0,0 +1,96 @@
+# Times the feature extraction through SpectralContext (one STFT, HPSS kept in the
+# spectral domain, shared mel spectrograms) against the previous path, where
+# librosa.effects.hpss does STFT + iSTFT and chroma, mfcc, onset_strength and
+# flux each run their own transform.
+#
+# usage: python benchmarks/spectral_benchmark.py [--minutes 3 10]
+
+import argparse
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import librosa
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    SpectralContext,
+    compute_chroma,
+    compute_mfcc,
+    compute_spectral_flux,
+    compute_tempogram,
+    highpass_filter,
+    stack_features,
+)
+from synthetic_audio import SR, synthetic_track  # noqa: E402
+
+
+# What get_phrase_boundaries_complex did before SpectralContext
+def features_previous(y, sr, times):
+    with stage(times, "hpss"):
+        y_harm, y_perc = librosa.effects.hpss(y)
+    with stage(times, "features"):
+        chroma = compute_chroma(y_harm, sr)
+        mfcc = compute_mfcc(y_harm, sr)
+        tempogram, onset_env = compute_tempogram(y_perc, sr)
+        flux = compute_spectral_flux(y_perc, sr)
+    return stack_features(chroma, mfcc, tempogram, onset_env, flux)
+
+
+def features_shared(y, sr, times):
+    spec = SpectralContext(y, sr)
+    with stage(times, "hpss"):
+        spec.hpss
+    with stage(times, "features"):
+        chroma = compute_chroma(sr=sr, S=spec.harmonic_magnitude)
+        mfcc = compute_mfcc(sr=sr, S=spec.harmonic_mel_db)
+        tempogram, onset_env = compute_tempogram(sr=sr, S=spec.percussive_mel_db)
+        flux = compute_spectral_flux(sr=sr, S=spec.percussive_magnitude)
+    return stack_features(chroma, mfcc, tempogram, onset_env, flux)
+
+
+@contextmanager
+def stage(times, name):
+    start = time.perf_counter()
+    yield
+    times[name] = time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3, 10])
+    args = parser.parse_args()
+
+    # warm up numba/fft plans so the first row is not penalised
+    features_shared(synthetic_track(0.1)[0], SR, {})
+
+    # "hpss" is STFT + median filtering (+ 2 iSTFT before), "features" is everything after it
+    print(
+        f"{'minutes':>8} {'path':>9} {'hpss (s)':>9} {'features (s)':>13} {'total (s)':>10} {'feature corr':>13}"
+    )
+    for minutes in args.minutes:
+        y = highpass_filter(synthetic_track(minutes)[0], SR)
+
+        previous_times, shared_times = {}, {}
+        previous = features_previous(y, SR, previous_times)
+        shared = features_shared(y, SR, shared_times)
+        corr = np.corrcoef(previous.ravel(), shared.ravel())[0, 1]
+
+        for name, times in (("previous", previous_times), ("shared", shared_times)):
+            print(
+                f"{minutes:>8g} {name:>9} {times['hpss']:>9.2f} {times['features']:>13.2f} "
+                f"{sum(times.values()):>10.2f} {corr if name == 'shared' else 1.0:>13.4f}"
+            )
+
+        print(
+            f"{'':>8} {'speedup':>9} {previous_times['hpss'] / shared_times['hpss']:>8.2f}x "
+            f"{previous_times['features'] / shared_times['features']:>12.2f}x "
+            f"{sum(previous_times.values()) / sum(shared_times.values()):>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
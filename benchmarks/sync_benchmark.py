@@ -0,0 +1,117 @@
+# Compares the frame rate novelty path with the beat synced one (--sync beats)
+# on synthetic tracks (see synthetic_audio.py).
+#
+# The features are extracted once per track, only the part that changes is
+# timed: beat tracking + syncing, the banded SSM, the novelty curve and the
+# peak picking. Accuracy is measured against the known section starts.
+#
+# usage: python benchmarks/sync_benchmark.py [--minutes 3 10] [--tolerance 0.5]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from DatasetTool import (  # noqa: E402
+    ANALYSIS_PARAMS,
+    NOVELTY_KERNEL_SEC,
+    BEAT_KERNEL_BEATS,
+    beat_sync_features,
+    compute_novelty_curve,
+    extract_features,
+    post_process_novelty,
+)
+from synthetic_audio import SR, synthetic_track  # noqa: E402
+
+MODES = ["frames", "beats"]
+
+
+# Same steps get_phrase_boundaries_complex runs after the features
+def detect(analysis, mode, top_k):
+    sr = ANALYSIS_PARAMS["sr"]
+    hop_length = ANALYSIS_PARAMS["hop_length"]
+
+    if mode == "frames":
+        L = int(NOVELTY_KERNEL_SEC * sr / hop_length)
+        novelty = compute_novelty_curve(analysis["features"], sr, L)
+        return post_process_novelty(novelty, sr, hop_length=hop_length, top_k=top_k), len(novelty)
+
+    features, times = beat_sync_features(
+        analysis["features"], analysis["onset_env"], sr, hop_length, bpm=analysis["tempo"]
+    )
+    novelty = compute_novelty_curve(features, sr, BEAT_KERNEL_BEATS)
+    boundaries = post_process_novelty(
+        novelty, sr, hop_length=hop_length, smoothing_window=1, times=times, top_k=top_k
+    )
+    return boundaries, len(novelty)
+
+
+# Precision, recall and F-measure of the detected boundaries, each real
+# boundary can be matched by at most one detected one
+def boundary_scores(detected, truth, tolerance):
+    detected = np.asarray(detected)
+    matched = set()
+    hits = 0
+    for t in detected:
+        distance = np.abs(truth - t)
+        for i in np.argsort(distance):
+            if distance[i] > tolerance:
+                break
+            if i not in matched:
+                matched.add(i)
+                hits += 1
+                break
+    precision = hits / len(detected) if len(detected) else 0.0
+    recall = hits / len(truth) if len(truth) else 0.0
+    f = 2 * precision * recall / (precision + recall) if hits else 0.0
+    return precision, recall, f
+
+
+def run(minutes, tmp_dir, tolerance, repeats):
+    y, truth = synthetic_track(minutes, seed=0)
+    path = os.path.join(tmp_dir, f"synthetic_{minutes:g}min.wav")
+    sf.write(path, y, SR)
+    del y
+
+    analysis = extract_features({"path": path, "sr": SR}, ANALYSIS_PARAMS)
+    os.remove(path)
+    # the first section start is the start of the track, nothing to detect there
+    truth = truth[1:]
+
+    print(f"\n{minutes:g} min, {len(truth)} section changes, tolerance {tolerance:g} s")
+    print(f"  {'mode':<7} {'frames':>7} {'time (s)':>9} {'speedup':>8} "
+          f"{'precision':>10} {'recall':>7} {'F':>6}")
+    base = None
+    for mode in MODES:
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            boundaries, n = detect(analysis, mode, top_k=len(truth))
+            best = min(best, time.perf_counter() - start)
+        base = base or best
+        precision, recall, f = boundary_scores(boundaries, truth, tolerance)
+        print(f"  {mode:<7} {n:>7} {best:>9.3f} {base / best:>7.1f}x "
+              f"{precision:>10.2f} {recall:>7.2f} {f:>6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs="+", default=[3, 10])
+    parser.add_argument("--tolerance", type=float, default=0.5, help="seconds")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for minutes in args.minutes:
+            run(minutes, tmp_dir, args.tolerance, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Deterministic synthetic tracks for the benchmarks, no audio files needed
+# A track is a 4/4 click track (kick every beat, hat every off beat) over a chord,
+# split into sections of a known number of bars. Each section changes the chord,
+# the timbre of the pad and whether the hats play, so the section starts are the
+# ground truth phrase boundaries.
+
+import numpy as np
+
+SR = 22050
+
+# root frequencies (A2..G3) and chord shapes as frequency ratios
+ROOTS = np.array([110.0, 123.5, 130.8, 146.8, 164.8, 174.6, 196.0])
+CHORDS = [(1.0, 1.26, 1.5), (1.0, 1.19, 1.5), (1.0, 1.26, 1.5, 1.78)]
+
+
+def click(length, freq, decay, sr=SR):
+    t = np.arange(int(length * sr)) / sr
+    return (np.exp(-t / decay) * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def noise_click(length, decay, rng, sr=SR):
+    t = np.arange(int(length * sr)) / sr
+    return (np.exp(-t / decay) * rng.uniform(-1, 1, len(t))).astype(np.float32)
+
+
+# Returns (y, boundaries) where boundaries are the section start times in seconds
+def synthetic_track(minutes, seed=0, bpm=128.0, bars_per_section=(4, 8, 16), sr=SR):
+    rng = np.random.default_rng(seed)
+    n_samples = int(minutes * 60 * sr)
+    beat = 60.0 / bpm
+    beat_samples = beat * sr
+
+    kick = click(0.15, 55.0, 0.03, sr)
+    hat = 0.3 * noise_click(0.05, 0.01, rng, sr)
+
+    y = np.zeros(n_samples, dtype=np.float32)
+    boundaries = []
+    start_beat = 0
+    while True:
+        start = int(round(start_beat * beat_samples))
+        if start >= n_samples:
+            break
+        n_beats = 4 * int(rng.choice(bars_per_section))
+        end = min(n_samples, int(round((start_beat + n_beats) * beat_samples)))
+        boundaries.append(start / sr)
+
+        # pad: chord with a random number of harmonics
+        t = np.arange(end - start, dtype=np.float32) / sr
+        root = rng.choice(ROOTS)
+        chord = CHORDS[rng.integers(len(CHORDS))]
+        n_harmonics = int(rng.integers(1, 5))
+        for ratio in chord:
+            for h in range(1, n_harmonics + 1):
+                y[start:end] += (0.15 / h) * np.sin(2 * np.pi * root * ratio * h * t)
+
+        # drums, the hats only play in some sections
+        with_hats = rng.random() < 0.5
+        for b in range(n_beats):
+            onset = int(round((start_beat + b) * beat_samples))
+            add(y, kick, onset)
+            if with_hats:
+                add(y, hat, onset + int(beat_samples / 2))
+
+        start_beat += n_beats
+
+    y += 0.005 * rng.standard_normal(n_samples).astype(np.float32)
+    y /= np.max(np.abs(y))
+    return y, np.array(boundaries)
+
+
+def add(y, sound, onset):
+    if onset >= len(y):
+        return
+    end = min(len(y), onset + len(sound))
+    y[onset:end] += sound[: end - onset]
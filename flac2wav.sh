@@ -1,5 +1,7 @@
 # This will take flac files and convert them to wav files which is much better for us to work with
 # ensure you have ffmpeg installed on your machine to get this to work
+# DatasetTool.py reads the FLACs directly now, this is only needed if something else wants WAVs
+# (python DatasetTool.py --export-wav does the same conversion in parallel without ffmpeg)
 
 shopt -s nullglob
 
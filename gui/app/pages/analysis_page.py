@@ -67,8 +67,9 @@ class AnalysisPage(tk.Frame):
         
         self.json_path = json_path
         self.folder_path = folder_path
-        self.transition_audio_files = []
-        self.current_index = 0
+        self.transitions = None
+        self.loaded = False
+        self._load_id = None
         self.new_json_path = None
         
         tk.Label(
@@ -85,7 +86,8 @@ class AnalysisPage(tk.Frame):
             self,
             json_path=json_path,
             folder_path=folder_path,
-            on_complete=self.on_transitions_created
+            on_complete=self.on_transitions_created,
+            on_start=self.close_transitions
         )
         
         
@@ -129,24 +131,40 @@ class AnalysisPage(tk.Frame):
         self.rating_frame.pack_forget()  
     
     # called when transitions done computing
-    def on_transitions_created(self, transition_audio_path):
+    # transitions is a TransitionQueue, its clips are rendered while we rate
+    def on_transitions_created(self, transitions):
+        self.close_transitions()
         self.new_json_path = create_json_copy(self.json_path)
-        self.transition_audio_files = sorted(Path(transition_audio_path).glob("*.wav"))
-        if not self.transition_audio_files:
-            messagebox.showerror("Error", "No transition files found.")
+        self.transitions = transitions
+        if not len(self.transitions):
+            messagebox.showerror("Error", "No transitions could be built from the results.")
             return
         
-        messagebox.showinfo("Ready", f"{len(self.transition_audio_files)} transitions found.")
+        messagebox.showinfo("Ready", f"{len(self.transitions)} transitions found.")
         self.rating_frame.pack(pady=15)
         self.load_next_audio()
     
     def load_next_audio(self):
-        if self.current_index >= len(self.transition_audio_files):
+        self._load_id = None
+        self.loaded = False
+        if self.transitions.current() is None:
             messagebox.showinfo("Done", "All transitions rated!")
             return
         
-        audio_path = str(self.transition_audio_files[self.current_index])
-        file_name = self.transition_audio_files[self.current_index].name
+        # normally already prefetched, otherwise check back until it is rendered
+        if not self.transitions.is_ready():
+            self.song_label.config(text="Rendering the next transition...")
+            self._load_id = self.after(100, self.load_next_audio)
+            return
+        
+        try:
+            audio_path = str(self.transitions.clip_path())
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not create this transition, skipping it: {e}")
+            self.transitions.advance()
+            self.load_next_audio()
+            return
+        file_name = Path(audio_path).name
     
         pattern = r'(.*?)-TO-(.*?)-exit([\d.]+)-entry([\d.]+)\.wav'
         match = re.match(pattern, file_name)
@@ -162,11 +180,16 @@ class AnalysisPage(tk.Frame):
         self.comment_box.delete("1.0", tk.END)
         self.rating_entry.delete(0, tk.END)
         self.rating_entry.insert(0, "5")
+        self.loaded = True
     
     def submit_rating(self):
+        # nothing is playing yet to rate
+        if not self.loaded:
+            return
+        
         rating = self.rating_entry.get()
         comment = self.comment_box.get("1.0", tk.END).strip()
-        file_name = self.transition_audio_files[self.current_index].name
+        file_name = Path(self.transitions.current()["output_path"]).name
         
        
         try:
@@ -189,8 +212,26 @@ class AnalysisPage(tk.Frame):
             messagebox.showerror("Error", f"Could not write to JSON: {e}")
             return
         
-        self.current_index += 1
+        self.transitions.advance()
         self.load_next_audio()
+    
+    # Stops the current queue's prefetching, before a new analysis clears the
+    # transition folder under it or its queue replaces this one
+    def close_transitions(self):
+        if self._load_id is not None:
+            self.after_cancel(self._load_id)
+            self._load_id = None
+        if self.transitions is not None:
+            self.transitions.close()
+            self.transitions = None
+        self.loaded = False
+        self.song_label.config(text="")
+        self.rating_frame.pack_forget()
+    
+    # leaving the page stops the prefetching
+    def destroy(self):
+        self.close_transitions()
+        super().destroy()
 
         
         
@@ -1,28 +1,29 @@
 import tkinter as tk
-from app.widgets.helper_scripts.create_transition_audio import compute_transition_audio
-from tkinter import messagebox
-import os
+from tkinter import messagebox, ttk
 import json
+import queue
 from pathlib import Path
 import shutil
-import librosa
-import numpy as np
 
-import matplotlib
-
-matplotlib.use("Agg")  # noqa: E402
-import matplotlib.pyplot as plt
-
-from jupyter_core.version import parts
+from app.widgets.helper_scripts.transition_queue import TransitionQueue
+from app.widgets.helper_scripts.transition_worker import TransitionWorker, format_progress
 
 
 class AnalyzeButton(tk.Frame):
-    def __init__(self, parent, json_path, folder_path, on_complete=None):
+    # how often the worker's progress messages are picked up, in ms
+    POLL_INTERVAL = 100
+
+    # on_start is called right before the transition folder of a previous run is cleared
+    def __init__(self, parent, json_path, folder_path, on_complete=None, on_start=None):
         super().__init__(parent)
 
         self.on_complete = on_complete
+        self.on_start = on_start
         self.json_path = json_path
         self.folder_path = folder_path
+        self.new_folder_path = None
+        self.worker = None
+        self._poll_id = None
 
         self.analyze_button = tk.Button(
             self,
@@ -36,12 +37,39 @@ class AnalyzeButton(tk.Frame):
 
         self.analyze_button.pack(pady=10)
 
+        # only shown while transitions are being generated
+        self.progress_frame = tk.Frame(self)
+        self.progress_bar = ttk.Progressbar(
+            self.progress_frame, length=400, mode="determinate"
+        )
+        self.progress_bar.pack(pady=5)
+        self.progress_label = tk.Label(self.progress_frame, text="")
+        self.progress_label.pack()
+        self.cancel_button = tk.Button(
+            self.progress_frame,
+            text="Cancel",
+            command=self.cancel_pressed,
+            fg="black",
+            activebackground="#3e3e3e",
+            padx=10,
+            pady=5,
+        )
+        self.cancel_button.pack(pady=5)
+
     # so now, we loop through the json, get boths songs, and load them.
     # then for each phrase boundary compute the transition clips
     # so if there are n^2 phrase boundaries, then we have n^2 to rank for each song
     # so each song pair generates 2*(n^2) rankings, then move on down the list changing song a
+    # A TransitionWorker in other processes measures the loudness around every boundary
+    # once per song and keeps the pairs whose loudness matches, this only starts it and
+    # keeps the progress bar up to date, so the window stays responsive
+    # on_complete gets a TransitionQueue of those pairs, which renders each clip
+    # shortly before it is rated instead of all of them up front
 
     def analyze_pressed(self):
+        if self.worker is not None and self.worker.is_alive():
+            return
+
         # data is the original json, new path is the new folder path the new file is saved at (where to write to)
         # maybe should return the new json path to modify for us
         with open(self.json_path, "r") as f:
@@ -52,6 +80,9 @@ class AnalyzeButton(tk.Frame):
         new_folder_name = "transition_files"
         new_folder_path = original_folder_path.parent / new_folder_name
 
+        if callable(self.on_start):
+            self.on_start()
+
         if new_folder_path.exists():
             shutil.rmtree(new_folder_path)
 
@@ -62,186 +93,72 @@ class AnalyzeButton(tk.Frame):
             message="depending on the length of songs, this may take a while",
         )
 
-        song_array = data["songs"]
-        for i, song_a in enumerate(song_array):
-            for j, song_b in enumerate(song_array):
-
-                # skip matching songs with eachother and ones we have already computed.
-                if i <= j:
-                    continue
-
-                # now we compute all new audio files in song_a
-                exit_boundaries_a = song_a["features"]["last_phrase_boundaries"]
-                entry_boundaries_b = song_b["features"]["first_phrase_boundaries"]
-
-                for exit_boundary in exit_boundaries_a:
-                    for entry_boundary in entry_boundaries_b:
-
-                        exit_time = self._time_to_secs(exit_boundary)
-                        entry_time = self._time_to_secs(entry_boundary)
-
-                        song_a_path = os.path.join(
-                            self.folder_path, song_a["song_name"]
-                        )
-                        song_b_path = os.path.join(
-                            self.folder_path, song_b["song_name"]
-                        )
-
-                        audio_file_name = f"{
-                            song_a['song_name']}-TO-{song_b['song_name']}-exit{exit_time}-entry{entry_time}.wav"
-
-                        output_path = new_folder_path / audio_file_name
-
-                        exit_time = self._time_to_secs(exit_boundary)
-                        entry_time = self._time_to_secs(entry_boundary)
-
-                        trend_a = compute_trend_line(
-                            song_a_path,
-                            boundary_time=exit_time,
-                            duration=2.0,
-                            visualize=False,
-                            save_dir="debug_trends",
-                        )
-                        trend_b = compute_trend_line(
-                            song_b_path,
-                            boundary_time=entry_time + 2.0,
-                            duration=2.0,
-                            visualize=False,
-                            save_dir="debug_trends",
-                        )
-
-                        end_loud_a = np.mean(trend_a[-50:])
-                        start_loud_b = np.mean(trend_b[:50])
-
-                        if abs(end_loud_a - start_loud_b) < 0.1:
-                            _ = compute_transition_audio(
-                                song_a=song_a_path,
-                                song_b=song_b_path,
-                                time_a=exit_time,
-                                time_b=entry_time,
-                                output_path=output_path,
-                            )
-                        else:
-                            print("Skipping transition")
-
-                        # Uncomment this and comment out from exit_time to print for the original way
-                        # _ = compute_transition_audio(song_a=song_a_path, song_b=song_b_path, time_a=exit_time,
-                        #                                  time_b=entry_time, output_path=output_path)
-
-                # NOW WE GO THE OTHER WAY, ESSENTIALLY COPYING WHAT WE HAVE DONE HERE
-                exit_boundaries_b = song_b["features"]["last_phrase_boundaries"]
-                entry_boundaries_a = song_a["features"]["first_phrase_boundaries"]
-
-                for exit_boundary in exit_boundaries_b:
-                    for entry_boundary in entry_boundaries_a:
-
-                        exit_time = self._time_to_secs(exit_boundary)
-                        entry_time = self._time_to_secs(entry_boundary)
-
-                        song_a_path = os.path.join(
-                            self.folder_path, song_b["song_name"]
-                        )
-                        song_b_path = os.path.join(
-                            self.folder_path, song_a["song_name"]
-                        )
-
-                        audio_file_name = f"{
-                            song_b['song_name']}-TO-{song_a['song_name']}-exit{exit_time}-entry{entry_time}.wav"
-
-                        output_path = new_folder_path / audio_file_name
-
-                        exit_time = self._time_to_secs(exit_boundary)
-                        entry_time = self._time_to_secs(entry_boundary)
-
-                        trend_a = compute_trend_line(
-                            song_a_path,
-                            boundary_time=exit_time,
-                            duration=2.0,
-                            visualize=False,
-                            save_dir="debug_trends",
-                        )
-                        trend_b = compute_trend_line(
-                            song_b_path,
-                            boundary_time=entry_time + 2.0,
-                            duration=2.0,
-                            visualize=False,
-                            save_dir="debug_trends",
-                        )
-
-                        end_loud_a = np.mean(trend_a[-50:])
-                        start_loud_b = np.mean(trend_b[:50])
-
-                        if abs(end_loud_a - start_loud_b) < 0.1:
-                            _ = compute_transition_audio(
-                                song_a=song_a_path,
-                                song_b=song_b_path,
-                                time_a=exit_time,
-                                time_b=entry_time,
-                                output_path=output_path,
-                            )
-                        else:
-                            print("Skipping transition")
-
-                        # Uncomment this and comment out from exit_time to print for the original way
-                        # _ = compute_transition_audio(song_a=song_a_path, song_b=song_b_path, time_a=exit_time,
-                        #                                  time_b=entry_time, output_path=output_path)
+        self.new_folder_path = new_folder_path
+        self.worker = TransitionWorker(data, self.folder_path, new_folder_path)
+
+        self.analyze_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.progress_bar.config(maximum=max(1, len(data["songs"])), value=0)
+        self.progress_label.config(text="Measuring loudness...")
+        self.progress_frame.pack(pady=5)
+
+        self.worker.start()
+        self._poll_id = self.after(self.POLL_INTERVAL, self._poll_worker)
+
+    def cancel_pressed(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_button.config(state="disabled")
+            self.progress_label.config(text="Cancelling...")
+
+    # Picks up everything the worker sent since the last poll, runs on the Tk thread
+    def _poll_worker(self):
+        self._poll_id = None
+        # checked before draining, a worker that has exited already queued all it sends
+        alive = self.worker.is_alive()
+        finished = None
+        while True:
+            try:
+                message = self.worker.messages.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "progress":
+                _, stage, done, total, elapsed = message
+                self.progress_bar.config(maximum=max(1, total), value=done)
+                if not self.worker.is_cancelled():
+                    self.progress_label.config(
+                        text=f"Measuring loudness: {format_progress(done, total, elapsed, 'songs')}"
+                    )
+            else:
+                finished = message
+
+        if finished is None and not alive:
+            finished = ("error", "the worker stopped without finishing")
+
+        if finished is None:
+            self._poll_id = self.after(self.POLL_INTERVAL, self._poll_worker)
+            return
+
+        self.progress_frame.pack_forget()
+        self.analyze_button.config(state="normal")
+
+        if finished[0] == "error":
+            messagebox.showerror("Error", f"Could not create the transitions: {finished[1]}")
+            return
+
+        _, jobs, cancelled = finished
+        if cancelled:
+            return
 
         if callable(self.on_complete):
-            self.on_complete(new_folder_path)
-
-    def _time_to_secs(self, time):
-        str_representation = str(time)
-        part = str_representation.split(":")
-
-        if len(part) == 2:
-            minutes, seconds = part
-            return int(minutes) * 60 + float(seconds)
-        else:
-            return float(part[0])
-
-        # minutes = minutes[1]
-        #
-        # return float((int(minutes) * 60) + (int(seconds)))
-
-
-def compute_trend_line(
-    song, boundary_time, duration=2.0, num_windows=700, visualize=False, save_dir=None
-):
-    y, sr = librosa.load(song, sr=None)
-
-    start_sample = max(0, int((boundary_time - duration) * sr))
-    end_sample = min(len(y), int(boundary_time * sr))
-
-    segment = y[start_sample:end_sample]
-
-    if len(segment) < num_windows:
-        segment = np.pad(segment, (0, num_windows - len(segment)))
-
-    total_samples = len(segment)
-    window_size = total_samples // num_windows
-    trimmed = segment[: window_size * num_windows].reshape(num_windows, window_size)
-
-    trend_line = np.mean(np.abs(trimmed), axis=1)
-    trend_line /= trend_line.max() + 1e-9
-
-    if visualize and save_dir:
-        os.makedirs(save_dir, exist_ok=True)
-        fig, ax = plt.subplots(figsize=(10, 4))
-        times = np.linspace(0, duration, len(segment))
-        trend_times = np.linspace(0, duration, len(trend_line))
-        ax.plot(times, segment, alpha=0.6, color="gray", label="Waveform")
-        ax.plot(
-            trend_times,
-            trend_line * np.max(np.abs(segment)),
-            color="red",
-            linewidth=2,
-            label="Trend Line",
-        )
-        ax.set_title(f"Trend Line at {boundary_time:.2f}s")
-        ax.set_xlabel("Time (s)")
-        ax.legend()
-        plt.tight_layout()
-        fig.savefig(os.path.join(save_dir, f"trend_{boundary_time:.2f}.png"))
-        plt.close(fig)
-
-    return trend_line
+            self.on_complete(TransitionQueue(jobs, self.new_folder_path))
+
+    # leaving the page stops the worker too
+    def destroy(self):
+        if self._poll_id is not None:
+            self.after_cancel(self._poll_id)
+            self._poll_id = None
+        if self.worker is not None:
+            self.worker.cancel()
+        super().destroy()
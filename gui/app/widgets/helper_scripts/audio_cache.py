@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+from math import gcd
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+# Per process. The loudness workers each have their own and free it when the
+# run's pool closes, the one in the GUI process is used to render the clips
+# being rated and is cleared when their TransitionQueue is closed. The helpers
+# only read a few seconds around each boundary, so this holds the segments of
+# a whole library many times over.
+AUDIO_CACHE_BYTES = 1024**3
+
+# Extra audio decoded on each side of a segment that gets resampled, so the
+# resampling filter has real signal to work with at the edges
+RESAMPLE_PAD_SEC = 0.1
+
+
+# (sample rate, length in samples) of a file at sr, or at its own rate when sr is None
+# The length matches what librosa.load(path, sr=sr) would return, computed the
+# same way librosa.resample does, which can come out one sample longer than exact
+def audio_info(path, sr=None):
+    info = sf.info(path)
+    if sr is None or sr == info.samplerate:
+        return info.samplerate, info.frames
+    return sr, int(np.ceil(info.frames * (sr / info.samplerate)))
+
+
+# Samples start..stop of a file at sr, same values as librosa.load(path, sr=sr,
+# mono=False)[..., start:stop] but only that part of the file is decoded
+# soundfile seeks straight to the segment in WAV and FLAC. With a different sr
+# only the segment (plus RESAMPLE_PAD_SEC each side) is resampled, starting on a
+# sample both rates share so it lines up with resampling the whole file
+def read_segment(path, start=0, stop=None, sr=None):
+    with sf.SoundFile(path) as f:
+        native_sr = f.samplerate
+        sr = native_sr if sr is None else sr
+        length = audio_info(path, sr)[1]
+        stop = length if stop is None else min(stop, length)
+        start = min(max(0, start), stop)
+
+        if sr == native_sr:
+            f.seek(start)
+            y = f.read(stop - start, dtype="float32", always_2d=True).T
+        else:
+            step = native_sr // gcd(native_sr, sr)
+            pad = int(RESAMPLE_PAD_SEC * native_sr)
+            first = max(0, (start * native_sr // sr - pad) // step * step)
+            last = min(f.frames, -(-stop * native_sr // sr) + pad)
+            f.seek(first)
+            y = f.read(last - first, dtype="float32", always_2d=True).T
+            y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+            offset = first * sr // native_sr
+            # librosa.resample zero pads a whole file up to audio_info's length too
+            y = librosa.util.fix_length(y[:, start - offset :], size=stop - start)
+
+    # librosa.load(mono=False) gives mono files as one dimensional arrays
+    if y.shape[0] == 1:
+        y = y[0]
+    return np.ascontiguousarray(y), sr
+
+
+# Decoded segments kept in memory between calls, least recently used first out
+# The trend line and crossfade windows of a boundary are the same for every
+# partner song, so each is decoded once per run. The arrays are shared between
+# callers, so they are read only
+class AudioCache:
+    def __init__(self, max_bytes=AUDIO_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # (y, sr) like read_segment
+    def load(self, path, sr=None, start=0, stop=None):
+        key = (os.path.abspath(path), sr, start, stop)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = read_segment(path, start=start, stop=stop, sr=sr)
+        entry[0].setflags(write=False)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.bytes += entry[0].nbytes
+            # the newest entry always stays, even when it is bigger than the cap on its own
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (y, _) = self._entries.popitem(last=False)
+                self.bytes -= y.nbytes
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+_cache = AudioCache()
+
+
+# Decoded audio from the process wide cache, the whole file unless start/stop are given
+def load_audio(path, sr=None, start=0, stop=None):
+    return _cache.load(path, sr=sr, start=start, stop=stop)
+
+
+def audio_cache():
+    return _cache
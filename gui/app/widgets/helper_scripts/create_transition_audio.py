@@ -6,6 +6,13 @@ import sys
 from pathlib import Path
 import soundfile as sf
 
+from app.widgets.helper_scripts.audio_cache import audio_info, load_audio
+
+import matplotlib
+
+matplotlib.use("Agg")  # noqa: E402
+import matplotlib.pyplot as plt
+
 
 """
 This file will contain all of the helper files to do the following
@@ -55,15 +62,18 @@ def compute_transition_audio(
     sr=None
 ):
 
-    # Load audio files if paths are provided
+    # Audio files given as paths are only read around the transition (see the
+    # segment reads below), here only their sample rate and length are needed
     if isinstance(song_a, str):
-        audio_a, sr_a = librosa.load(song_a, sr=sr, mono=False)
+        audio_a = None
+        sr_a, length_a = audio_info(song_a, sr=sr)
     else:
         audio_a = song_a
         sr_a = sr if sr is not None else 22050
 
     if isinstance(song_b, str):
-        audio_b, sr_b = librosa.load(song_b, sr=sr_a, mono=False)
+        audio_b = None
+        sr_b, length_b = audio_info(song_b, sr=sr_a)
     else:
         audio_b = song_b
         sr_b = sr_a
@@ -77,11 +87,10 @@ def compute_transition_audio(
         audio_b = librosa.resample(audio_b, orig_sr=sr_b, target_sr=sr_a)
         sr_b = sr_a
 
-    # Handle stereo/mono compatibility
-    if audio_a.ndim == 1 and audio_b.ndim == 2:
-        audio_a = np.stack([audio_a, audio_a])
-    elif audio_a.ndim == 2 and audio_b.ndim == 1:
-        audio_b = np.stack([audio_b, audio_b])
+    if audio_a is not None:
+        length_a = audio_a.shape[-1]
+    if audio_b is not None:
+        length_b = audio_b.shape[-1]
 
     # Convert time positions to sample indices
     start_a_samples = int(time_a * sr)
@@ -103,7 +112,7 @@ def compute_transition_audio(
     # Extract the segments from each song
     # Segment from song A: starts before the crossfade point
     segment_a_start = max(0, start_a_samples - actual_pre_samples)
-    segment_a_end = min(audio_a.shape[-1], start_a_samples + crossfade_samples)
+    segment_a_end = min(length_a, start_a_samples + crossfade_samples)
 
     # Ensure we have enough audio from song A for the crossfade
     available_a_for_crossfade = segment_a_end - start_a_samples
@@ -117,23 +126,25 @@ def compute_transition_audio(
     # Segment from song B: starts at the crossfade point
     segment_b_start = start_b_samples
     segment_b_end = min(
-        audio_b.shape[-1], start_b_samples + actual_crossfade_samples + post_samples)
+        length_b, start_b_samples + actual_crossfade_samples + post_samples)
 
     # Check if song B has enough audio for the crossfade
     available_b_for_crossfade = min(
-        audio_b.shape[-1] - segment_b_start, actual_crossfade_samples)
+        length_b - segment_b_start, actual_crossfade_samples)
     if available_b_for_crossfade < actual_crossfade_samples:
         print(f"Warning: Song B has only {
               available_b_for_crossfade/sr:.2f}s available for crossfade, adjusting")
         actual_crossfade_samples = available_b_for_crossfade
 
-    # Extract segments
-    if audio_a.ndim == 1:
-        segment_a = audio_a[segment_a_start:segment_a_end]
-        segment_b = audio_b[segment_b_start:segment_b_end]
-    else:
-        segment_a = audio_a[:, segment_a_start:segment_a_end]
-        segment_b = audio_b[:, segment_b_start:segment_b_end]
+    # Extract segments, only these samples are decoded for paths
+    segment_a = _extract_segment(song_a, audio_a, segment_a_start, segment_a_end, sr)
+    segment_b = _extract_segment(song_b, audio_b, segment_b_start, segment_b_end, sr)
+
+    # Handle stereo/mono compatibility
+    if segment_a.ndim == 1 and segment_b.ndim == 2:
+        segment_a = np.stack([segment_a, segment_a])
+    elif segment_a.ndim == 2 and segment_b.ndim == 1:
+        segment_b = np.stack([segment_b, segment_b])
 
     # Recalculate actual samples based on what we extracted
     actual_pre_samples = start_a_samples - segment_a_start
@@ -147,7 +158,7 @@ def compute_transition_audio(
 
     # Create the crossfade
     # Pre-transition part (only song A)
-    if audio_a.ndim == 1:
+    if segment_a.ndim == 1:
         pre_transition = segment_a[:actual_pre_samples]
     else:
         pre_transition = segment_a[:, :actual_pre_samples]
@@ -158,7 +169,7 @@ def compute_transition_audio(
         fade_out = np.linspace(1, 0, actual_crossfade_samples)
         fade_in = np.linspace(0, 1, actual_crossfade_samples)
 
-        if audio_a.ndim == 1:
+        if segment_a.ndim == 1:
             crossfade_a = segment_a[actual_pre_samples:
                                     actual_pre_samples + actual_crossfade_samples]
             crossfade_b = segment_b[:actual_crossfade_samples]
@@ -184,7 +195,7 @@ def compute_transition_audio(
         crossfade_mixed = np.array([])
 
     # Post-transition part (only song B)
-    if audio_b.ndim == 1:
+    if segment_b.ndim == 1:
         post_transition = segment_b[actual_crossfade_samples:
                                     actual_crossfade_samples + actual_post_samples]
     else:
@@ -192,7 +203,7 @@ def compute_transition_audio(
                                     actual_crossfade_samples:actual_crossfade_samples + actual_post_samples]
 
     # Combine all parts
-    if audio_a.ndim == 1:
+    if segment_a.ndim == 1:
         combined_audio = np.concatenate([
             pre_transition,
             crossfade_mixed,
@@ -211,7 +222,7 @@ def compute_transition_audio(
         combined_audio = combined_audio / max_val * 0.95
 
     # Save the output
-    if audio_a.ndim == 2:
+    if segment_a.ndim == 2:
         # Transpose for soundfile (expects shape: (samples, channels))
         combined_audio = combined_audio.T
 
@@ -221,6 +232,61 @@ def compute_transition_audio(
     return combined_audio, sr
 
 
+# Samples start..stop of a song given as a path (read from the file through the
+# cache) or as an array
+def _extract_segment(song, audio, start, stop, sr):
+    if audio is None:
+        return load_audio(song, sr=sr, start=start, stop=stop)[0]
+    return audio[..., start:stop]
+
+
+# Loudness trend of the duration seconds before boundary_time, in num_windows steps
+# normalized to its own peak, the transition gate compares the ends of two of these
+def compute_trend_line(
+    song, boundary_time, duration=2.0, num_windows=700, visualize=False, save_dir=None
+):
+    # only the duration seconds before the boundary are read from the file
+    sr, n_samples = audio_info(song)
+
+    start_sample = max(0, int((boundary_time - duration) * sr))
+    end_sample = min(n_samples, int(boundary_time * sr))
+
+    y, sr = load_audio(song, start=start_sample, stop=end_sample)
+    segment = librosa.to_mono(y)
+
+    if len(segment) < num_windows:
+        segment = np.pad(segment, (0, num_windows - len(segment)))
+
+    total_samples = len(segment)
+    window_size = total_samples // num_windows
+    trimmed = segment[: window_size * num_windows].reshape(num_windows, window_size)
+
+    trend_line = np.mean(np.abs(trimmed), axis=1)
+    trend_line /= trend_line.max() + 1e-9
+
+    if visualize and save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+        fig, ax = plt.subplots(figsize=(10, 4))
+        times = np.linspace(0, duration, len(segment))
+        trend_times = np.linspace(0, duration, len(trend_line))
+        ax.plot(times, segment, alpha=0.6, color="gray", label="Waveform")
+        ax.plot(
+            trend_times,
+            trend_line * np.max(np.abs(segment)),
+            color="red",
+            linewidth=2,
+            label="Trend Line",
+        )
+        ax.set_title(f"Trend Line at {boundary_time:.2f}s")
+        ax.set_xlabel("Time (s)")
+        ax.legend()
+        plt.tight_layout()
+        fig.savefig(os.path.join(save_dir, f"trend_{boundary_time:.2f}.png"))
+        plt.close(fig)
+
+    return trend_line
+
+
 if __name__ == "__main__":
     # new_path = create_json_copy("/Users/alexpower/Documents/Music-Dataset-Tool/results.json")
     # print(new_path)
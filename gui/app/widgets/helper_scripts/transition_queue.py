@@ -0,0 +1,107 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from app.widgets.helper_scripts.audio_cache import audio_cache
+from app.widgets.helper_scripts.transition_worker import PARTIAL_FOLDER, render_transition
+
+# How many clips after the one being rated are kept rendered
+PREFETCH_CLIPS = 3
+
+
+# The transitions to rate, in order, each rendered only shortly before it is played
+# Holds the job descriptors from transition_jobs. A background thread renders the
+# current clip first, then keeps the next PREFETCH_CLIPS ready so there is no wait
+# after a rating is submitted. Rated clips are deleted again, so the folder only
+# ever holds a handful of WAVs however large the library is.
+class TransitionQueue:
+    def __init__(self, jobs, output_folder, prefetch=PREFETCH_CLIPS):
+        self.jobs = jobs
+        self.output_folder = Path(output_folder)
+        self.prefetch = prefetch
+        self.position = 0
+        self._rendered = {}
+        self._errors = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    # The job being rated, None once every transition was rated
+    def current(self):
+        if self.position >= len(self.jobs):
+            return None
+        return self.jobs[self.position]
+
+    # True once the current clip is rendered (or failed to render)
+    def is_ready(self):
+        with self._condition:
+            return self.position in self._rendered or self.position in self._errors
+
+    # Path of the current clip, raises what rendering it raised
+    def clip_path(self):
+        with self._condition:
+            if self.position in self._errors:
+                raise self._errors[self.position]
+            return self._rendered[self.position]
+
+    # Moves on to the next transition
+    # The clip before the one just rated is deleted, the rated one may still be
+    # loaded in the music player until the next one replaces it
+    def advance(self):
+        with self._condition:
+            self.position += 1
+            stale = self._rendered.pop(self.position - 2, None)
+            self._condition.notify_all()
+        if stale is not None:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    # Waits for a clip that is rendering to finish, so nothing writes to the
+    # output folder once this returns
+    # The rendering filled this process's audio cache, it is freed here too
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        shutil.rmtree(self.output_folder / PARTIAL_FOLDER, ignore_errors=True)
+        audio_cache().clear()
+
+    # First clip from the current one on that is not rendered yet, within the prefetch window
+    def _next_to_render(self):
+        end = min(len(self.jobs), self.position + self.prefetch + 1)
+        for index in range(self.position, end):
+            if index not in self._rendered and index not in self._errors:
+                return index
+        return None
+
+    def _prefetch_loop(self):
+        while True:
+            with self._condition:
+                while not self._closed and self._next_to_render() is None:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                index = self._next_to_render()
+
+            try:
+                path = render_transition(self.jobs[index])
+            except Exception as e:
+                print(f"Could not render {self.jobs[index]['output_path']}: {e}")
+                with self._condition:
+                    self._errors[index] = e
+                continue
+
+            with self._condition:
+                # rated while it was rendering, nobody will play it
+                if index < self.position - 1:
+                    os.remove(path)
+                else:
+                    self._rendered[index] = path
@@ -0,0 +1,220 @@
+import os
+import queue
+import threading
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+from app.widgets.helper_scripts.create_transition_audio import (
+    compute_transition_audio,
+    compute_trend_line,
+)
+
+# Clips are written here first and moved into the output folder once complete,
+# so a clip only shows up there once it can be played
+PARTIAL_FOLDER = ".partial"
+
+# A pair is only kept when the loudness at the end of the exit and at the start
+# of the entry (mean of EDGE_WINDOWS trend line windows each) is closer than this
+LOUDNESS_GATE = 0.1
+EDGE_WINDOWS = 50
+
+
+def time_to_secs(time):
+    part = str(time).split(":")
+    if len(part) == 2:
+        minutes, seconds = part
+        return int(minutes) * 60 + float(seconds)
+    return float(part[0])
+
+
+# What one song needs measured, cheap to send to a worker process
+def song_task(song, folder_path):
+    features = song["features"]
+    return {
+        "path": os.path.join(folder_path, song["song_name"]),
+        "exit_times": [time_to_secs(t) for t in features["last_phrase_boundaries"]],
+        "entry_times": [time_to_secs(t) for t in features["first_phrase_boundaries"]],
+    }
+
+
+# Runs in a worker process: the edge loudness of every phrase boundary of one song
+# exit: end of the 2 s trend line leading up to a last phrase boundary
+# entry: start of the 2 s trend line after a first phrase boundary
+# They only depend on the song and the boundary, so each is measured once per run
+# instead of once for every partner song
+def song_loudness(task):
+    exits = [
+        np.mean(compute_trend_line(task["path"], boundary_time=t, duration=2.0)[-EDGE_WINDOWS:])
+        for t in task["exit_times"]
+    ]
+    entries = [
+        np.mean(compute_trend_line(task["path"], boundary_time=t + 2.0, duration=2.0)[:EDGE_WINDOWS])
+        for t in task["entry_times"]
+    ]
+    return exits, entries
+
+
+# Per song loudness lists as one (songs x boundaries) array, NaN where a song
+# has fewer boundaries so those slots never pass the gate
+def _padded(values):
+    width = max((len(v) for v in values), default=0)
+    array = np.full((len(values), width), np.nan)
+    for i, v in enumerate(values):
+        array[i, : len(v)] = v
+    return array
+
+
+# Every (exit, entry) boundary pair that passes the loudness gate, in both directions
+# for every song pair, in the order the old loop rendered them
+# loudness is [(exit_loudness, entry_loudness)] per song, from song_loudness
+# The gate is checked for all pairs of a song against every other song at once
+def transition_jobs(data, tasks, loudness, output_folder):
+    song_array = data["songs"]
+    exit_loud = _padded([exits for exits, _ in loudness])
+    entry_loud = _padded([entries for _, entries in loudness])
+
+    jobs = []
+    for i, song_a in enumerate(song_array):
+        # [exit of i, song, entry of song] and [song, exit of song, entry of i]
+        with np.errstate(invalid="ignore"):
+            out_of_a = np.abs(exit_loud[i][:, None, None] - entry_loud[None]) < LOUDNESS_GATE
+            into_a = np.abs(exit_loud[:, :, None] - entry_loud[i][None, None]) < LOUDNESS_GATE
+
+        for j, song_b in enumerate(song_array):
+            # skip matching songs with eachother and ones we have already computed.
+            if i <= j:
+                continue
+            jobs.extend(
+                _direction_jobs(song_a, song_b, tasks[i], tasks[j], out_of_a[:, j, :], output_folder)
+            )
+            jobs.extend(
+                _direction_jobs(song_b, song_a, tasks[j], tasks[i], into_a[j], output_folder)
+            )
+    return jobs
+
+
+# song_a's last phrase boundaries into song_b's first ones, passes[exit, entry]
+def _direction_jobs(song_a, song_b, task_a, task_b, passes, output_folder):
+    jobs = []
+    for exit_index, entry_index in np.argwhere(passes):
+        exit_time = task_a["exit_times"][exit_index]
+        entry_time = task_b["entry_times"][entry_index]
+        file_name = (
+            f"{song_a['song_name']}-TO-{song_b['song_name']}"
+            f"-exit{exit_time}-entry{entry_time}.wav"
+        )
+        jobs.append(
+            {
+                "song_a": task_a["path"],
+                "song_b": task_b["path"],
+                "exit_time": exit_time,
+                "entry_time": entry_time,
+                "output_path": str(Path(output_folder) / file_name),
+            }
+        )
+    return jobs
+
+
+# Number of (exit, entry) pairs before the gate, same loops as transition_jobs
+def candidate_count(tasks):
+    exits = np.array([len(task["exit_times"]) for task in tasks])
+    entries = np.array([len(task["entry_times"]) for task in tasks])
+    return int(exits.sum() * entries.sum() - exits @ entries)
+
+
+# Writes the crossfade of one pair that passed the gate, returns its path
+def render_transition(job):
+    output_path = Path(job["output_path"])
+    partial_path = output_path.parent / PARTIAL_FOLDER / output_path.name
+    partial_path.parent.mkdir(parents=True, exist_ok=True)
+    compute_transition_audio(
+        song_a=job["song_a"],
+        song_b=job["song_b"],
+        time_a=job["exit_time"],
+        time_b=job["entry_time"],
+        output_path=str(partial_path),
+    )
+    os.replace(partial_path, output_path)
+    return output_path
+
+
+# Measures every song and finds the pairs that pass the gate, in a process pool
+# driven from a background thread. Nothing is rendered here, the jobs go to a
+# TransitionQueue that renders each clip shortly before it is rated.
+# The GUI never waits on it, it polls messages off self.messages instead:
+#   ("progress", stage, done, total, elapsed_seconds), stage "loudness" (songs)
+#   ("done", jobs, cancelled)
+#   ("error", message)
+class TransitionWorker:
+    def __init__(self, data, folder_path, output_folder, workers=None, chunksize=4):
+        self.data = data
+        self.folder_path = folder_path
+        self.output_folder = Path(output_folder)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.chunksize = chunksize
+        self.messages = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Stops after the songs in progress, the pool is terminated so nothing new starts
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # Anything that goes wrong, a malformed results file included, ends in an
+    # "error" message so the GUI never waits on a thread that is gone
+    def _run(self):
+        try:
+            tasks = [song_task(song, self.folder_path) for song in self.data["songs"]]
+            jobs = []
+            with Pool(self.workers) as pool:
+                loudness = self._stage(pool, "loudness", song_loudness, tasks)
+
+            if not self._cancel.is_set():
+                jobs = transition_jobs(self.data, tasks, loudness, self.output_folder)
+                print(f"{len(jobs)} of {candidate_count(tasks)} pairs passed the loudness gate")
+        except Exception as e:
+            self.messages.put(("error", str(e)))
+            return
+
+        self.messages.put(("done", jobs, self._cancel.is_set()))
+
+    # Runs func over items in the pool, reporting each result, until done or cancelled
+    # imap keeps the results in the order of the items
+    def _stage(self, pool, stage, func, items):
+        results = []
+        start = time.perf_counter()
+        for result in pool.imap(func, items, chunksize=self.chunksize):
+            results.append(result)
+            self.messages.put(
+                ("progress", stage, len(results), len(items), time.perf_counter() - start)
+            )
+            if self._cancel.is_set():
+                # leaving the with block in _run terminates the workers
+                break
+        return results
+
+
+# "1234/5000 clips, 3.1/s, ETA 20:15"
+def format_progress(done, total, elapsed, unit="clips"):
+    rate = done / elapsed if elapsed > 0 else 0.0
+    text = f"{done}/{total} {unit}, {rate:.1f}/s"
+    if rate > 0 and done < total:
+        remaining = int((total - done) / rate)
+        hours, rest = divmod(remaining, 3600)
+        minutes, seconds = divmod(rest, 60)
+        eta = f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+        text += f", ETA {eta}"
+    return text